@@ -1,14 +1,30 @@
 #!/usr/bin/env python3
 
+# Taken before anything else is imported, for --timeline
+import time
+started = time.perf_counter()
+
+import argparse
+import logging
+import sys
 import tkinter as tk
 import tkinter.font as tkf
 from tkinter import ttk
 from tkinter import messagebox
-import tkcalendar as tkc
+from tkinter import filedialog
 
 __author__ = 'Colin Leary'
 
+import changefeed
+import config
 import db
+import diagnostics
+import executor
+import exporter
+import importer
+import journal
+import widgets
+import writes
 
 # Create a list of the tables & their attributes to be used when the UI interacts with the database
 tables = {
@@ -39,17 +55,16 @@ class InsertButtonCallback:
             self.window.destroy()
 
 class RemoveButtonCallback:
-    def __init__(self, db, table_name, tree_view, refresh_func):
-        self.db = db
+    def __init__(self, writes, table_name, tree_view):
+        self.writes = writes
         self.table_name = table_name
         self.tree_view = tree_view
-        self.refresh_func = refresh_func
 
     def __call__(self):
-        ids = ','.join(i for i in self.tree_view.selection())
-        self.db.remove(self.table_name,
-                       f'id in ({ids})')
-        self.refresh_func()
+        for i in self.tree_view.selection():
+            self.writes.remove((self.table_name, int(i)),
+                               self.table_name,
+                               {'id': int(i)})
 
 class UpdateMenuCallback:
     def __init__(self, set_label, label, set_id, id):
@@ -62,42 +77,218 @@ class UpdateMenuCallback:
         self.set_label(self.label)
         self.set_id(self.id)
 
+class ImportWindow:
+    def __init__(self, master, executor, kind, path):
+        self.executor = executor
+        self.cancel_requested = False
+
+        self.win = tk.Toplevel(master)
+        self.win.title(f'Importing {kind}')
+        self.win.protocol('WM_DELETE_WINDOW', self.cancel)
+
+        tk.Grid.columnconfigure(self.win, 0, weight=1)
+
+        label = tk.Label(self.win, text=path)
+        label.grid(row=0, column=0, padx=5, pady=5, sticky=tk.W)
+
+        self.progress = ttk.Progressbar(self.win, length=300, maximum=100)
+        self.progress.grid(row=1, column=0, padx=5, pady=5, sticky=tk.EW)
+
+        cancel_button = tk.Button(self.win, text='Cancel', command=self.cancel)
+        cancel_button.grid(row=2, column=0, padx=5, pady=5, sticky=tk.E)
+
+        # The import runs on a worker - progress is passed back to the Tk
+        # thread, and the cancel flag is checked between chunks
+        self.executor.submit(
+            lambda db: self.run(db, kind, path),
+            self.finished)
+
+    def run(self, db, kind, path):
+        try:
+            return importer.import_csv(
+                db, kind, path,
+                progress=lambda f: self.executor.call_soon(self.set_progress, f),
+                cancelled=lambda: self.cancel_requested)
+        except (ValueError, OSError, importer.ImportCancelled) as e:
+            return e
+
+    def set_progress(self, fraction):
+        if self.win.winfo_exists():
+            self.progress['value'] = fraction * 100
+
+    def cancel(self):
+        self.cancel_requested = True
+
+    def finished(self, result):
+        if self.win.winfo_exists():
+            self.win.destroy()
+
+        if isinstance(result, importer.ImportCancelled):
+            messagebox.showinfo('Import', f'Import cancelled. {result}')
+        elif isinstance(result, Exception):
+            messagebox.showinfo('Error', f'Import failed! {result}')
+        else:
+            messagebox.showinfo('Import', str(result))
+
+class DiagnosticsWindow:
+    def __init__(self, master, stats):
+        self.stats = stats
+
+        self.win = tk.Toplevel(master)
+        self.win.title('Diagnostics')
+        self.win.geometry(f'+{master.winfo_x()}+{master.winfo_y()}')
+
+        tk.Grid.columnconfigure(self.win, 4, weight=1)
+        tk.Grid.rowconfigure(self.win, 1, weight=3)
+        tk.Grid.rowconfigure(self.win, 3, weight=1)
+
+        label = tk.Label(self.win, text='Slow query threshold (ms):')
+        label.grid(row=0, column=0, padx=5, pady=5)
+
+        self.slow_ms = tk.IntVar(value=stats.slow_ms)
+        threshold = tk.Spinbox(self.win, from_=1, to=60000, increment=50,
+                               width=7, textvariable=self.slow_ms,
+                               command=self.apply_settings)
+        threshold.bind('<Return>', self.apply_settings)
+        threshold.grid(row=0, column=1, padx=5, pady=5)
+
+        self.explain = tk.BooleanVar(value=stats.explain)
+        explain_box = tk.Checkbutton(self.win, text='EXPLAIN slow queries',
+                                     variable=self.explain,
+                                     command=self.apply_settings)
+        explain_box.grid(row=0, column=2, padx=5, pady=5)
+
+        reset_button = tk.Button(self.win, text='Reset', command=self.reset)
+        reset_button.grid(row=0, column=5, padx=5, pady=5, sticky=tk.E)
+        refresh_button = tk.Button(self.win, text='Refresh', command=self.refresh)
+        refresh_button.grid(row=0, column=6, padx=5, pady=5, sticky=tk.E)
+
+        titles = ['Query', 'Callers', 'Count', 'Cache Hits', 'p50 (ms)', 'p95 (ms)', 'Rows', 'Bytes']
+        self.shapes = ttk.Treeview(self.win, columns=titles, show='headings')
+        for col in titles:
+            self.shapes.heading(col, text=col)
+            self.shapes.column(col, width=80 if col not in ('Query', 'Callers') else 300)
+        self.shapes.grid(row=1, column=0, columnspan=7, sticky=tk.NSEW)
+
+        label = tk.Label(self.win, text='Slow queries:')
+        label.grid(row=2, column=0, padx=5, sticky=tk.W)
+
+        titles = ['Time', 'ms', 'Rows', 'Caller', 'Query', 'Plan']
+        self.slow = ttk.Treeview(self.win, columns=titles, show='headings')
+        for col in titles:
+            self.slow.heading(col, text=col)
+            self.slow.column(col, width=80 if col in ('Time', 'ms', 'Rows') else 250)
+        self.slow.grid(row=3, column=0, columnspan=7, sticky=tk.NSEW)
+
+        self.refresh()
+
+    def apply_settings(self, *args):
+        try:
+            self.stats.slow_ms = self.slow_ms.get()
+        except tk.TclError:
+            pass
+
+        self.stats.explain = self.explain.get()
+
+    def reset(self):
+        self.stats.reset()
+        self.refresh()
+
+    def refresh(self):
+        self.shapes.delete(*self.shapes.get_children())
+        for sql, callers, count, hits, p50, p95, rows, size in self.stats.summary():
+            self.shapes.insert('', 'end', values=(sql, callers, count, hits,
+                                                  f'{p50:.1f}', f'{p95:.1f}',
+                                                  rows, size))
+
+        self.slow.delete(*self.slow.get_children())
+        for when, ms, rows, where, sql, plan in reversed(self.stats.slow_queries()):
+            self.slow.insert('', 'end', values=(when, f'{ms:.1f}', rows, where, sql,
+                                                '' if plan is None else str(plan)))
+
+# Frames never touch the database directly - all queries go through the
+# executor and land back in a callback once the results are ready.
+#
+# A frame loads nothing until it is first shown. After that, writes to any of
+# the tables in depends mark it dirty, and it reloads the next time it is on
+# screen.
 class DbFrame(tk.Frame):
-    def __init__(self, master, db, table_name):
+    def __init__(self, master, executor, table_name, depends):
         self.master = master
         self.table_name = table_name
-        self.db = db
+        self.executor = executor
+        self.depends = set(depends)
+        self.dirty = True
+
+        # Frames that batch their edits keep them in a WriteBatch here
+        self.writes = None
         super().__init__(master)
 
-        self.layout()
-        self.refresh()
+        # Widgets are built the first time the tab is shown, and it says it
+        # is loading until its data first arrives
+        self.built = False
+        self.has_data = False
+        self.placeholder = tk.Label(self, text='Loading...')
 
     def layout(self):
         pass
 
+    def show(self):
+        if not self.built:
+            self.built = True
+            self.layout()
+
+            if not self.has_data:
+                self.placeholder.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
+                self.placeholder.lift()
+
+        if self.dirty:
+            self.dirty = False
+            self.refresh()
+
+    def changed(self, changes):
+        # Rows changed by any client, as table -> {row id: 'I', 'U' or 'D'}.
+        # Unless a frame can apply them itself, it reloads the next time it
+        # is shown.
+        self.dirty = True
+
+    def loaded(self):
+        if not self.has_data:
+            self.has_data = True
+            self.placeholder.place_forget()
+            self.event_generate('<<Loaded>>')
+
     def refresh(self):
         pass
 
 class EntityFrame(DbFrame):
-    def __init__(self, master, db, table_name):
+    def __init__(self, master, executor, save, table_name):
         self.attr_list = tables[table_name]['attrs']
         self.titles = tables[table_name]['titles']
-        super().__init__(master, db, table_name)
+        super().__init__(master, executor, table_name, [table_name])
+
+        # Adds and deletes go through the journal like every other edit
+        self.writes = writes.WriteBatch(master, save, on_failed=self.refresh)
 
     def layout(self):
         tk.Grid.rowconfigure(self, 0, weight=1)
         tk.Grid.columnconfigure(self, 0, weight=1)
         tk.Grid.columnconfigure(self, 1, weight=1)
 
-        self.tree_view = ttk.Treeview(self, columns=self.titles, show='headings')
-
-        self.remove = RemoveButtonCallback(self.db,
+        # Only the rows on screen are loaded, a page at a time, and sorting
+        # and filtering are done by the database
+        self.tree_view = widgets.VirtualTable(
+            self,
+            self.titles,
+            self.executor,
+            self.fetch_page,
+            self.count_rows,
+            seek=self.seek_page,
+            on_loaded=self.loaded)
+
+        self.remove = RemoveButtonCallback(self.writes,
                                            self.table_name,
-                                           self.tree_view,
-                                           self.refresh)
-
-        for col in self.titles:
-            self.tree_view.heading(col, text=col)
+                                           self.tree_view)
 
         self.tree_view.grid(column=0,
                                row=0,
@@ -110,14 +301,47 @@ class EntityFrame(DbFrame):
         add_button.grid(row=1, column=1, sticky=tk.NSEW)
 
     def refresh(self):
-        attrs = 'id,'+','.join(self.attr_list)
+        self.tree_view.refresh()
 
-        # Clear out the tree so we can add everything back in
-        self.tree_view.delete(*self.tree_view.get_children())
+    def changed(self, changes):
+        if not self.built:
+            self.dirty = True
+            return
 
-        items = self.db.get(self.table_name, attrs)
-        for item in items:
-            self.tree_view.insert('', 'end', item[0], values=item[1:])
+        rows = changes.get(self.table_name, {})
+        if rows and all(op == 'U' for op in rows.values()):
+            self.tree_view.reload(rows)
+        else:
+            self.tree_view.refresh()
+
+    # VirtualTable hands over its view as (column, descending, prefix)
+    def order_by(self, column):
+        return self.attr_list[column] if column is not None else 'id'
+
+    def where(self, column, prefix):
+        # The filter matches the start of the sorted column, or the first
+        # column when unsorted
+        if not prefix:
+            return None
+
+        return [(self.attr_list[column or 0], 'PREFIX', prefix)]
+
+    def fetch_page(self, db, after, limit, column, descending, prefix):
+        return db.get_page(self.table_name, self.attr_list,
+                           after=after,
+                           order_by=self.order_by(column),
+                           descending=descending,
+                           limit=limit,
+                           where=self.where(column, prefix))
+
+    def count_rows(self, db, column, descending, prefix):
+        return db.count(self.table_name, where=self.where(column, prefix))
+
+    def seek_page(self, db, offset, column, descending, prefix):
+        return db.get_page_key(self.table_name, offset,
+                               order_by=self.order_by(column),
+                               descending=descending,
+                               where=self.where(column, prefix))
 
     def push_add_window(self):
         win = tk.Toplevel()
@@ -150,27 +374,40 @@ class EntityFrame(DbFrame):
 
 
     def add(self, entries):
-        a = ','.join(s for s in self.attr_list)
-        e = ','.join(f'("{s}")' for s in entries)
-
-        self.db.insert(self.table_name, a, e)
-
-        self.refresh()
+        self.writes.insert((self.table_name, 'add', tuple(entries)),
+                           self.table_name,
+                           self.attr_list,
+                           entries)
 
         return True
 
 class EnrollmentFrame(DbFrame):
-    def __init__(self, master, db):
+    def __init__(self, master, executor, save, depends=('enrollment_data', 'courses', 'students')):
         self.INVALID_TERM_STR = 'Select Term'
         self.INVALID_COURSE_STR = 'Select Course'
         self.INVALID_ID = -1
         self.term_str = tk.StringVar(value=self.INVALID_TERM_STR)
         self.course_id = tk.IntVar(value = self.INVALID_ID)
         self.course_str = tk.StringVar(value=self.INVALID_COURSE_STR)
-        super().__init__(master, db, 'enrollment')
+
+        # Students as last loaded, and the names of students added since
+        self.students = []
+        self.names = {}
+
+        # Sorting by name and filtering on it are done by the database
+        self.sort_names = False
+        self.descending = False
+        self.filter_str = tk.StringVar()
+        self.filter_timer = None
+        super().__init__(master, executor, 'enrollment', depends)
+
+        # Edits are shown at once and saved together
+        self.writes = writes.WriteBatch(master, save,
+                                        on_failed=self.refresh,
+                                        on_change=self.show_status)
 
     def layout(self):
-        tk.Grid.rowconfigure(self, 1, weight=1)
+        tk.Grid.rowconfigure(self, 2, weight=1)
         tk.Grid.columnconfigure(self, 0, weight=1)
         tk.Grid.columnconfigure(self, 1, weight=1)
 
@@ -185,23 +422,57 @@ class EnrollmentFrame(DbFrame):
         self.course_menu = tk.OptionMenu(self, self.course_str, None)
         self.course_menu.grid(column=1, row=0)
 
-        # Create tree view to show students enrolled
+        # Create filter box to narrow the students by name
+        filter_frame = tk.Frame(self)
+        tk.Grid.columnconfigure(filter_frame, 1, weight=1)
+        tk.Label(filter_frame, text='Name starts with:').grid(column=0, row=0, padx=5)
+        tk.Entry(filter_frame, textvariable=self.filter_str).grid(column=1, row=0, padx=5, sticky=tk.EW)
+        self.filter_str.trace_add('write', self.on_filter)
+        filter_frame.grid(column=0, row=1, columnspan=2, pady=2, sticky=tk.EW)
+
+        # Create tree view to show students enrolled, sorted by clicking
+        # the heading
         self.tree_view = ttk.Treeview(self, columns='items', show='headings')
-        self.tree_view.heading(0, text='Students')
+        self.tree_view.heading(0, text='Students', command=self.sort_by_name)
         self.tree_view.grid(column=0,
-                               row=1,
+                               row=2,
                                columnspan=2,
                                sticky=tk.NSEW)
-
-        self.remove = RemoveButtonCallback(self.db,
-                                           'enrollment_data',
-                                           self.tree_view,
-                                           self.refresh)
+        self.rows = widgets.RowReconciler(self.tree_view)
 
         delete_button = tk.Button(self, text='Delete', command=self.remove)
-        delete_button.grid(row=2, column=0, sticky=tk.NSEW)
+        delete_button.grid(row=3, column=0, sticky=tk.NSEW)
         add_button = tk.Button(self, text='Add New', command=self.push_add_window)
-        add_button.grid(row=2, column=1, sticky=tk.NSEW)
+        add_button.grid(row=3, column=1, sticky=tk.NSEW)
+
+        self.status = tk.Label(self, anchor=tk.W)
+        self.status.grid(row=4, column=0, columnspan=2, sticky=tk.EW)
+
+    def sort_by_name(self):
+        # Ascending, then descending, then back to enrollment order
+        if not self.sort_names:
+            self.sort_names, self.descending = True, False
+        elif not self.descending:
+            self.descending = True
+        else:
+            self.sort_names, self.descending = False, False
+
+        arrow = ''
+        if self.sort_names:
+            arrow = ' \u25bc' if self.descending else ' \u25b2'
+        self.tree_view.heading(0, text='Students' + arrow)
+
+        self.update_student_list()
+
+    def on_filter(self, *args):
+        # Wait for typing to pause before asking again
+        if self.filter_timer is not None:
+            self.after_cancel(self.filter_timer)
+        self.filter_timer = self.after(250, self.apply_filter)
+
+    def apply_filter(self):
+        self.filter_timer = None
+        self.update_student_list()
 
     def push_add_window(self):
         win = tk.Toplevel()
@@ -227,66 +498,94 @@ class EnrollmentFrame(DbFrame):
         label = tk.Label(win, text='Course:')
         label.grid(row=1, column=0, padx=5, pady=5)
 
-        # Create drop-down to select course
-        course_var = tk.StringVar(value=self.course_str.get())
+        # Type-ahead to pick a course, starting on the one selected
+        course_var = tk.StringVar(value=self.course_str.get()
+                                  if self.course_id.get() != self.INVALID_ID else '')
         course_id = tk.IntVar(value=self.course_id.get())
 
-        course_menu = self.build_option_menu(self.db, ['id', 'course_name'], 'courses', win, course_var, course_id)
-        course_menu.grid(column=1, row=1, columnspan=2, padx=5, pady=5, sticky=tk.EW)
+        course_picker = widgets.TypeAhead(win, self.executor,
+                                        lambda db, prefix: db.search('courses', 'course_name', prefix,
+                                                                     extra=['instructor_name']),
+                                        course_id,
+                                        invalid_id=self.INVALID_ID,
+                                        textvariable=course_var)
+        course_picker.grid(column=1, row=1, columnspan=2, padx=5, pady=5, sticky=tk.EW)
 
         label = tk.Label(win, text='Student:')
         label.grid(row=2, column=0, padx=5, pady=5)
 
-        # Create drop-down to select student
-        student_var = tk.StringVar(value='Select Student')
+        # Type-ahead to pick a student
+        student_var = tk.StringVar(value='')
         student_id = tk.IntVar(value=self.INVALID_ID)
 
-        student_menu = self.build_option_menu(self.db, ['id', 'name'], 'students', win, student_var, student_id)
-        student_menu.grid(column=1, row=2, columnspan=2, padx=5, pady=5, sticky=tk.EW)
+        student_picker = widgets.TypeAhead(win, self.executor,
+                                         lambda db, prefix: db.search('students', 'name', prefix),
+                                         student_id,
+                                         invalid_id=self.INVALID_ID,
+                                         textvariable=student_var)
+        student_picker.grid(column=1, row=2, columnspan=2, padx=5, pady=5, sticky=tk.EW)
 
         cancel_button = tk.Button(win, text='Cancel', command=win.destroy)
         cancel_button.grid(row=3, column=1, sticky=tk.EW, padx=5, pady=(h, 0))
 
-        data = [entry, course_id, student_id]
+        data = [entry, course_id, student_id, student_var]
 
         add_action = InsertButtonCallback(self.add, data, win)
         action_button = tk.Button(win, text='Add', command=add_action)
         action_button.grid(row=3, column=2, sticky=tk.EW, padx=5, pady=(h, 0))
 
-    def build_option_menu(self, db, attr_list, table, win, str_var, id_var):
-        attrs = ','.join(a for a in attr_list)
+    def add(self, data):
+        term, course_id, student_id, name = data
+        if term == '' or course_id == self.INVALID_ID or student_id == self.INVALID_ID:
+            return False
 
-        data = db.get(table, attrs)
-        option_menu = tk.OptionMenu(win, str_var, [])
+        self.names[student_id] = name
+        self.writes.insert(('enrolled', term, course_id, student_id),
+                           'enrollment_data',
+                           ['term', 'course_id', 'student_id'],
+                           [term, course_id, student_id])
+        self.show_students()
 
-        menu = option_menu['menu']
-        menu.delete(0, 'end')
+        return True
 
-        for item in data:
-            label = f'{item[1]}'
-            id = item[0]
-            menu.add_command(label=label,
-                             command=UpdateMenuCallback(str_var.set,
-                                                        label,
-                                                        id_var.set,
-                                                        id))
+    def remove(self):
+        # Students added but not yet saved have no id to remove by
+        for iid in self.tree_view.selection():
+            if iid.isdigit():
+                self.writes.remove(('enrollment_data', int(iid)),
+                                   'enrollment_data',
+                                   {'id': int(iid)})
 
-        return option_menu
+        self.show_students()
 
-    def add(self, data):
-        if data[0] == '' or data[1] == self.INVALID_ID or data[2] == self.INVALID_ID:
-            return False
+    def show_status(self):
+        n = len(self.writes)
+        self.status.config(text=f'{n} unsaved change{"s" if n != 1 else ""}' if n else '')
 
-        success = self.db.insert('enrollment_data',
-                                'term, course_id, student_id',
-                                f'("{data[0]}", {data[1]}, {data[2]})')
+    def changed(self, changes):
+        if not self.built:
+            self.dirty = True
+            return
 
-        self.refresh()
+        # Enrollments added or removed can change the menus
+        if any(op != 'U' for op in changes.get('enrollment_data', {}).values()):
+            self.update_term_menu()
+            self.update_course_menu()
 
-        return success
+        # Marks and scores only matter for the students on screen, but any
+        # other change may be to who is listed
+        shown = {s[0] for s in self.students}
+        if any(table not in ('attendance', 'grades') or shown.intersection(rows)
+               for table, rows in changes.items()):
+            self.update_student_list()
 
     def update_term_menu(self):
-        terms = self.db.get('enrollment', 'DISTINCT(term)')
+        self.executor.submit(lambda db: db.get_terms(),
+                             self.fill_term_menu,
+                             key=(self, 'terms'))
+
+    def fill_term_menu(self, terms):
+        self.loaded()
 
         term_list = [term[0] for term in terms]
 
@@ -302,14 +601,18 @@ class EnrollmentFrame(DbFrame):
 
     def update_course_menu(self, *args):
         if self.term_str.get() == self.INVALID_TERM_STR:
+            self.executor.cancel((self, 'courses'))
             self.course_id.set(self.INVALID_ID)
             self.course_str.set(self.INVALID_COURSE_STR)
             return
 
-        course_data = self.db.get('enrollment',
-                                  'DISTINCT c_name, c_id',
-                                  where=f'term="{self.term_str.get()}"')
+        # Any course list still loading for a previous term is discarded
+        term = self.term_str.get()
+        self.executor.submit(lambda db: db.get_term_courses(term),
+                             self.fill_course_menu,
+                             key=(self, 'courses'))
 
+    def fill_course_menu(self, course_data):
         # Replace menu
         menu = self.course_menu['menu']
         menu.delete(0, 'end')
@@ -325,20 +628,44 @@ class EnrollmentFrame(DbFrame):
             self.course_str.set(self.INVALID_COURSE_STR)
 
     def update_student_list(self, *args):
-        # Clear everything out of tree
-        self.tree_view.delete(*self.tree_view.get_children())
-
         if self.course_str.get() == self.INVALID_COURSE_STR:
+            self.executor.cancel((self, 'students'))
+            self.show_students([])
             return
 
-        where_clause = f'term="{self.term_str.get()}" AND c_id={self.course_id.get()}'
-
-        students = self.db.get('enrollment',
-                               'id, s_name',
-                               where=where_clause)
-
-        for student in students:
-            self.tree_view.insert('', 'end', student[0], values=f'"{student[1]}"')
+        term = self.term_str.get()
+        course_id = self.course_id.get()
+        sort = self.sort_names
+        descending = self.descending
+        prefix = self.filter_str.get()
+
+        self.executor.submit(lambda db: db.get_enrolled(term, course_id,
+                                                        sort=sort,
+                                                        descending=descending,
+                                                        prefix=prefix),
+                             self.show_students,
+                             key=(self, 'students'))
+
+    def show_students(self, students=None):
+        # What the database last returned, with unsaved edits laid over it.
+        # Only rows that actually changed are touched in the tree.
+        if students is not None:
+            self.students = students
+
+        rows = [s for s in self.students
+                if self.writes.state(('enrollment_data', s[0])) != 'remove']
+
+        # Students added to this course show up straight away
+        term = self.term_str.get()
+        course_id = self.course_id.get()
+        enrolled = {s[1] for s in rows}
+        for key, edit in self.writes.edits():
+            if key[:3] == ('enrolled', term, course_id) and edit[0] == 'insert':
+                name = self.names.get(key[3])
+                if name not in enrolled and name.lower().startswith(self.filter_str.get().lower()):
+                    rows.append((f'new-{key[3]}', name))
+
+        self.rows.update(rows)
 
     def refresh(self):
         self.update_term_menu()
@@ -347,8 +674,9 @@ class EnrollmentFrame(DbFrame):
 
 # The attendance frame is almost identical to the enrollment frame
 class AttendanceFrame(EnrollmentFrame):
-    def __init__(self, master, db):
-        super().__init__(master, db)
+    def __init__(self, master, executor, save):
+        super().__init__(master, executor, save,
+                         ('enrollment_data', 'courses', 'students', 'attendance'))
 
     def layout(self):
         tk.Grid.rowconfigure(self, 1, weight=1)
@@ -366,7 +694,9 @@ class AttendanceFrame(EnrollmentFrame):
         self.course_menu = tk.OptionMenu(self, self.course_str, None)
         self.course_menu.grid(column=2, row=0, columnspan=2)
 
-        # Create date-picker
+        # Create date-picker. tkcalendar is only imported once this tab is
+        # first shown.
+        import tkcalendar as tkc
         self.date_picker = tkc.DateEntry(self)
         self.date_picker.grid(column=5, row=0)
         self.date = self.date_picker.get_date()
@@ -380,66 +710,464 @@ class AttendanceFrame(EnrollmentFrame):
                                row=1,
                                columnspan=6,
                                sticky=tk.NSEW)
+        self.rows = widgets.RowReconciler(self.tree_view)
 
         not_present_button = tk.Button(self, text='Not Present', command=self.mark_not_present)
         not_present_button.grid(row=2, column=0, columnspan=3, sticky=tk.NSEW)
         present_button = tk.Button(self, text='Present', command=self.mark_present)
         present_button.grid(row=2, column=3, columnspan=3, sticky=tk.NSEW)
 
+        self.status = tk.Label(self, anchor=tk.W)
+        self.status.grid(row=3, column=0, columnspan=6, sticky=tk.EW)
+
     def mark_not_present(self):
-        ids = ','.join(i for i in self.tree_view.selection())
-        where_clause = f'date = "{self.date}" AND enrollment_id in ({ids})'
-        self.db.remove('attendance',
-                       where_clause)
+        for iid in self.tree_view.selection():
+            self.writes.remove(('attendance', int(iid), self.date),
+                               'attendance',
+                               {'date': self.date, 'enrollment_id': int(iid)})
 
-        self.refresh()
+        self.show_students()
 
     def mark_present(self):
-        values = ','.join(f'({id},"{self.date}")' for id in self.tree_view.selection())
-        self.db.insert('attendance',
-                       'enrollment_id, date',
-                       values,
-                       ignore_duplicates=True)
+        for iid in self.tree_view.selection():
+            self.writes.insert(('attendance', int(iid), self.date),
+                               'attendance',
+                               ['enrollment_id', 'date'],
+                               [int(iid), self.date])
 
-        self.refresh()
+        self.show_students()
 
     def update_date(self, *args):
         self.date = self.date_picker.get_date()
         self.refresh()
 
     def update_student_list(self, *args):
-        # Clear everything out of tree
-        self.tree_view.delete(*self.tree_view.get_children())
+        if self.course_str.get() == self.INVALID_COURSE_STR:
+            self.executor.cancel((self, 'students'))
+            self.show_students([])
+            return
+
+        # Get list of students along with whether they were present
+        term = self.term_str.get()
+        course_id = self.course_id.get()
+        date = self.date
+        self.executor.submit(lambda db: db.get_roster(term, course_id, date),
+                             self.show_students,
+                             key=(self, 'students'))
+
+    def show_students(self, students=None):
+        if students is not None:
+            self.students = students
+
+        rows = []
+        for student in self.students:
+            present = student[2]
+
+            # An unsaved mark wins over what was loaded
+            state = self.writes.state(('attendance', student[0], self.date))
+            if state is not None:
+                present = state == 'insert'
+
+            v = [student[0], f'{student[1]}']
+            if present:
+                v.append('X')
+
+            rows.append(v)
+
+        self.rows.update(rows)
+
+def grade_stats(grades):
+    # NumPy is optional - without it the gradebook still works, it just has
+    # no statistics
+    try:
+        import gradestats
+    except ImportError:
+        return None
+
+    return gradestats.course_stats(grades)
+
+# Scores for every student in a course, one column per assignment, edited
+# like a spreadsheet. Double-click (or press Return on) a cell to edit it;
+# Return and Tab move on to the next cell, and a block of tab-separated
+# scores can be pasted in at once. Edits are batched like attendance marks.
+class GradebookFrame(EnrollmentFrame):
+    def __init__(self, master, executor, save):
+        self.assignments = []
+        self.grades = {}
+        self.stats = None
+        self.editor = None
+        self.editing = None
+        self.column = 1
+        super().__init__(master, executor, save,
+                         ('enrollment_data', 'courses', 'students', 'assignments', 'grades'))
+
+    def layout(self):
+        tk.Grid.rowconfigure(self, 1, weight=3)
+        tk.Grid.rowconfigure(self, 3, weight=1)
+        tk.Grid.columnconfigure(self, 0, weight=1)
+        tk.Grid.columnconfigure(self, 1, weight=1)
+
+        # Create drop-down to select term
+        self.term_str.trace('w', self.update_course_menu)
+        self.term_menu = tk.OptionMenu(self, self.term_str, None)
+        self.term_menu.grid(column=0, row=0)
+
+        # Create drop-down to select course
+        self.course_id.trace_add('write', self.update_student_list)
+        self.course_menu = tk.OptionMenu(self, self.course_str, None)
+        self.course_menu.grid(column=1, row=0)
+
+        # One row per student, one column per assignment
+        self.tree_view = ttk.Treeview(self, columns=['student', 'total'], show='headings')
+        self.tree_view.grid(column=0, row=1, columnspan=2, sticky=tk.NSEW)
+        self.rows = widgets.RowReconciler(self.tree_view)
+        self.set_columns([])
+
+        scroll = ttk.Scrollbar(self, orient=tk.HORIZONTAL, command=self.tree_view.xview)
+        scroll.grid(column=0, row=2, columnspan=2, sticky=tk.EW)
+        self.tree_view.configure(xscrollcommand=scroll.set)
+
+        self.tree_view.bind('<Double-1>', self.edit_clicked)
+        self.tree_view.bind('<Return>', lambda e: self.start_edit(self.tree_view.focus(), self.column))
+        self.tree_view.bind('<<Paste>>', self.paste)
+
+        # Statistics for each assignment, and for the students' totals
+        titles = ['Assignment', 'Scores', 'Mean', 'Median', 'P25', 'P75', 'P90', 'Histogram (0-100)']
+        self.stats_view = ttk.Treeview(self, columns=titles, show='headings')
+        for col in titles:
+            self.stats_view.heading(col, text=col)
+            self.stats_view.column(col, width=70 if col not in ('Assignment', 'Histogram (0-100)') else 160)
+        self.stats_view.grid(column=0, row=3, columnspan=2, sticky=tk.NSEW)
+
+        self.status = tk.Label(self, anchor=tk.W)
+        self.status.grid(row=4, column=0, columnspan=2, sticky=tk.EW)
+
+    def set_columns(self, assignments):
+        columns = ['student'] + [f'a{a_id}' for a_id, name in assignments] + ['total']
+        if list(self.tree_view['columns']) == columns:
+            return
+
+        # Changing the columns invalidates every row
+        self.rows.clear()
+        self.tree_view['columns'] = columns
+        self.tree_view.heading('student', text='Student')
+        self.tree_view.column('student', width=160, stretch=False)
+        for a_id, name in assignments:
+            self.tree_view.heading(f'a{a_id}', text=name)
+            self.tree_view.column(f'a{a_id}', width=80, stretch=False, anchor=tk.E)
+        self.tree_view.heading('total', text='Total')
+        self.tree_view.column('total', width=80, stretch=False, anchor=tk.E)
 
+        self.assignments = list(assignments)
+
+    def update_student_list(self, *args):
         if self.course_str.get() == self.INVALID_COURSE_STR:
+            self.executor.cancel((self, 'students'))
+            self.show_students(([], self.assignments, [], None))
             return
 
-        # Get attendance
-        present = self.db.get('attendance',
-                              'enrollment_id',
-                              where=f'date="{self.date}"')
+        term = self.term_str.get()
+        course_id = self.course_id.get()
 
-        present = [i[0] for i in present]
+        # Scores and their statistics come from the same fetch
+        def load(db):
+            grades = db.get_course_grades(term, course_id)
+            return (db.get_enrolled(term, course_id),
+                    db.get('assignments', ['id', 'name'], order_by='id'),
+                    grades,
+                    grade_stats(grades) if grades else None)
 
-        # Get list of students
-        where_clause = f'term="{self.term_str.get()}" AND c_id={self.course_id.get()}'
-        students = self.db.get('enrollment',
-                               'id, s_name',
-                               where=where_clause)
+        self.executor.submit(load, self.show_students, key=(self, 'students'))
 
-        for student in students:
-            v = [f'{student[1]}']
-            if student[0] in present:
-                v.append('X')
+    def show_students(self, data=None):
+        if data is not None:
+            self.students, assignments, grades, self.stats = data
+            self.grades = {(e_id, a_id): score for e_id, a_id, score in grades}
+            self.set_columns(assignments)
+            self.show_stats()
+
+        totals = self.stats.student_totals() if self.stats is not None else {}
+
+        rows = []
+        for e_id, name in self.students:
+            row = [e_id, name]
+            for a_id, a_name in self.assignments:
+                score = self.score(e_id, a_id)
+                row.append('' if score is None else score)
+
+            total = totals.get(e_id)
+            row.append(f'{total[0]:g}' if total is not None else '')
+            rows.append(row)
+
+        self.rows.update(rows)
+
+    def score(self, e_id, a_id):
+        # An unsaved edit wins over what was loaded
+        edit = self.writes.edit(('grade', e_id, a_id))
+        if edit is not None:
+            return edit[3][2]
+
+        return self.grades.get((e_id, a_id))
+
+    def show_stats(self):
+        self.stats_view.delete(*self.stats_view.get_children())
+        if self.stats is None:
+            return
+
+        names = dict(self.assignments)
+        for a_id, count, mean, median, pct, hist in self.stats.assignment_rows():
+            self.stats_view.insert('', 'end', values=(names.get(a_id, a_id), count,
+                                                      f'{mean:.1f}', f'{median:.1f}',
+                                                      *(f'{p:.1f}' for p in (pct[0], pct[2], pct[3])),
+                                                      ' '.join(str(n) for n in hist)))
+
+        s = self.stats
+        counts, edges = s.total_histogram
+        self.stats_view.insert('', 'end', values=('Total', len(s.totals),
+                                                  f'{s.total_mean:.1f}', f'{s.total_median:.1f}',
+                                                  *(f'{p:.1f}' for p in (s.total_percentiles[0],
+                                                                         s.total_percentiles[2],
+                                                                         s.total_percentiles[3])),
+                                                  f'{edges[0]:g}-{edges[-1]:g}: '
+                                                  + ' '.join(str(n) for n in counts)))
+
+    def edit_clicked(self, event):
+        iid = self.tree_view.identify_row(event.y)
+        column = self.tree_view.identify_column(event.x)
+        if iid and column:
+            self.start_edit(iid, int(column[1:]) - 1)
+
+    def start_edit(self, iid, column):
+        if not self.finish_edit():
+            return
+
+        # Only assignment columns can be edited
+        if not iid or not 1 <= column <= len(self.assignments):
+            return
+
+        self.column = column
+        self.tree_view.focus(iid)
+        self.tree_view.selection_set(iid)
+        self.tree_view.see(iid)
+
+        bbox = self.tree_view.bbox(iid, column)
+        if not bbox:
+            return
+
+        x, y, w, h = bbox
+        self.editing = (int(iid), self.assignments[column - 1][0])
+        self.editor = tk.Entry(self.tree_view, justify=tk.RIGHT)
+        self.editor.place(x=x, y=y, width=w, height=h)
+        self.editor.insert(0, self.tree_view.set(iid, column))
+        self.editor.select_range(0, tk.END)
+        self.editor.focus_set()
+
+        self.editor.bind('<Return>', lambda e: self.move(iid, 1, 0))
+        self.editor.bind('<Tab>', lambda e: self.move(iid, 0, 1))
+        self.editor.bind('<Escape>', lambda e: self.cancel_edit())
+        self.editor.bind('<FocusOut>', lambda e: self.finish_edit())
+
+    def move(self, iid, down, right):
+        if not self.finish_edit():
+            return 'break'
+
+        items = self.tree_view.get_children()
+        index = items.index(iid) + down
+        column = self.column + right
+        if column > len(self.assignments):
+            column = 1
+            index += 1
+
+        if index < len(items):
+            self.start_edit(items[index], column)
+        else:
+            self.tree_view.focus_set()
+
+        return 'break'
+
+    def finish_edit(self):
+        # Queue whatever is in the editor - False if it is not a score
+        if self.editor is None:
+            return True
+
+        text = self.editor.get().strip()
+        e_id, a_id = self.editing
+
+        if not self.set_score(e_id, a_id, text):
+            self.bell()
+            return False
+
+        self.cancel_edit()
+        self.show_students()
+
+        return True
+
+    def cancel_edit(self):
+        if self.editor is not None:
+            editor = self.editor
+            self.editor = None
+            editor.destroy()
+            self.tree_view.focus_set()
+
+    def set_score(self, e_id, a_id, text):
+        if text == '':
+            score = None
+        else:
+            try:
+                score = int(text)
+            except ValueError:
+                return False
+
+        if score != self.score(e_id, a_id):
+            self.writes.upsert(('grade', e_id, a_id),
+                               'grades',
+                               ['enrollment_id', 'assignment_id', 'score'],
+                               [e_id, a_id, score])
+
+        return True
+
+    def paste(self, event=None):
+        # A block of tab-separated scores, filled in from the focused cell
+        try:
+            text = self.clipboard_get()
+        except tk.TclError:
+            return 'break'
+
+        items = self.tree_view.get_children()
+        iid = self.tree_view.focus()
+        if not iid:
+            return 'break'
+
+        start = items.index(iid)
+        for r, line in enumerate(text.splitlines()):
+            if start + r >= len(items):
+                break
+
+            e_id = int(items[start + r])
+            for c, value in enumerate(line.split('\t')):
+                column = self.column + c
+                if column > len(self.assignments):
+                    break
+
+                self.set_score(e_id, self.assignments[column - 1][0], value.strip())
+
+        self.show_students()
+
+        return 'break'
+
+# Students whose attendance has fallen below a threshold, across every
+# course in a term. Reads only the attendance summary, so it loads quickly
+# however many years of attendance are stored.
+class ReportsFrame(DbFrame):
+    def __init__(self, master, executor):
+        self.INVALID_TERM_STR = 'Select Term'
+        self.term_str = tk.StringVar(value=self.INVALID_TERM_STR)
+        self.threshold = tk.IntVar(value=80)
+        super().__init__(master, executor, 'attendance_summary',
+                         ('enrollment_data', 'courses', 'students', 'attendance'))
+
+    def layout(self):
+        tk.Grid.rowconfigure(self, 1, weight=1)
+        tk.Grid.columnconfigure(self, 0, weight=1)
+
+        self.term_str.trace_add('write', self.update_report)
+        self.term_menu = tk.OptionMenu(self, self.term_str, None)
+        self.term_menu.grid(column=0, row=0)
+
+        label = tk.Label(self, text='Attendance below (%):')
+        label.grid(column=1, row=0, padx=5)
+
+        threshold = tk.Spinbox(self, from_=0, to=100, increment=5, width=5,
+                               textvariable=self.threshold,
+                               command=self.update_report)
+        threshold.bind('<Return>', self.update_report)
+        threshold.grid(column=2, row=0, padx=5)
+
+        titles = ['Student', 'Course', 'Present', 'Class Days', 'Rate']
+        self.tree_view = ttk.Treeview(self, columns=titles, show='headings')
+        for col in titles:
+            self.tree_view.heading(col, text=col)
+        self.tree_view.grid(column=0,
+                               row=1,
+                               columnspan=3,
+                               sticky=tk.NSEW)
+        self.rows = widgets.RowReconciler(self.tree_view)
+
+    def update_term_menu(self):
+        self.executor.submit(lambda db: db.get_terms(),
+                             self.fill_term_menu,
+                             key=(self, 'terms'))
+
+    def fill_term_menu(self, terms):
+        self.loaded()
+
+        term_list = [term[0] for term in terms]
+
+        menu = self.term_menu['menu']
+        menu.delete(0, 'end')
+        for term in term_list:
+            menu.add_command(label=term,
+                             command=lambda value=term: self.term_str.set(value))
+
+        if self.term_str.get() not in term_list:
+            self.term_str.set(self.INVALID_TERM_STR)
+
+    def update_report(self, *args):
+        try:
+            threshold = self.threshold.get() / 100
+        except tk.TclError:
+            return
 
-            self.tree_view.insert('', 'end', student[0], values=v)
+        if self.term_str.get() == self.INVALID_TERM_STR:
+            self.executor.cancel((self, 'report'))
+            self.rows.clear()
+            return
+
+        term = self.term_str.get()
+        self.executor.submit(lambda db: db.get_at_risk(term, threshold),
+                             self.fill_report,
+                             key=(self, 'report'))
+
+    def fill_report(self, students):
+        self.rows.update([(id, name, course, present, days, f'{present / days:.0%}')
+                          for id, name, course, present, days in students])
+
+    def refresh(self):
+        self.update_term_menu()
+        self.update_report()
 
 class App:
-    def __init__(self, master):
-        # Create connection
+    def __init__(self, master, *, timeline=None):
+        # timeline, if given, is printed once the first data is shown
         self.master = master
-
-        self.db = db.Database(self.push_message_box)
+        self.timeline = timeline
+
+        # MySQL or embedded SQLite, as set in sie557.ini
+        settings = config.load()
+        self.backend = config.backend(settings)
+
+        # Every connection shares one result cache, so a write made through
+        # any of them invalidates what the others have cached. They also
+        # share one set of query statistics.
+        self.cache = db.QueryCache()
+        self.stats = diagnostics.QueryStats()
+
+        # Nothing here waits on the database - background workers each open
+        # their own connection, and the tabs fill in as their data arrives
+        self.executor = executor.QueryExecutor(master, self.connect, report=self.push_message_box)
+        self.executor.submit(lambda db: db.conn is not None, self.connected)
+
+        # Edits are saved to a journal on this computer first, and replayed
+        # into the database in the background - so they are never lost or
+        # held up when the server is slow or down
+        self.journal = journal.Journal(settings['journal']['path'])
+        self.journal_error = None
+        self.replayer = journal.Replayer(self.journal,
+                                         self.connect,
+                                         self.executor.call_soon,
+                                         on_replayed=self.replayed,
+                                         on_status=self.show_journal)
+        self.replayer.start()
 
         master.title('SIE557 Project')
 
@@ -470,54 +1198,269 @@ class App:
         self.tabs = ttk.Notebook(self.master)
 
         # Create Entity tabs
-        self.student_frame = EntityFrame(self.tabs, self.db, 'students')
+        self.student_frame = EntityFrame(self.tabs, self.executor, self.save, 'students')
         self.tabs.add(self.student_frame, text='Students')
 
-        self.course_frame = EntityFrame(self.tabs, self.db, 'courses')
+        self.course_frame = EntityFrame(self.tabs, self.executor, self.save, 'courses')
         self.tabs.add(self.course_frame, text='Courses')
 
-        self.assignment_frame = EntityFrame(self.tabs, self.db, 'assignments')
+        self.assignment_frame = EntityFrame(self.tabs, self.executor, self.save, 'assignments')
         self.tabs.add(self.assignment_frame, text='Assignments')
 
         # Create Relationship tabs
-        self.enrollment_frame = EnrollmentFrame(self.tabs, self.db)
+        self.enrollment_frame = EnrollmentFrame(self.tabs, self.executor, self.save)
         self.tabs.add(self.enrollment_frame, text='Enrollment')
 
-        self.attendance_frame = AttendanceFrame(self.tabs, self.db)
+        self.attendance_frame = AttendanceFrame(self.tabs, self.executor, self.save)
         self.tabs.add(self.attendance_frame, text='Attendance')
 
+        self.gradebook_frame = GradebookFrame(self.tabs, self.executor, self.save)
+        self.tabs.add(self.gradebook_frame, text='Gradebook')
+
+        self.reports_frame = ReportsFrame(self.tabs, self.executor)
+        self.tabs.add(self.reports_frame, text='Reports')
+
+        self.frames = [
+            self.student_frame,
+            self.course_frame,
+            self.assignment_frame,
+            self.enrollment_frame,
+            self.attendance_frame,
+            self.gradebook_frame,
+            self.reports_frame,
+        ]
+
+        for frame in self.frames:
+            frame.bind('<<Loaded>>', self.first_data)
+
+        # Other clients' edits are picked up from the change log
+        self.changes = changefeed.ChangeFeed(master, self.executor, self.apply_changes, self.refresh)
+        self.changes.start()
+
+        # Shows edits still waiting to reach the database
+        self.status = tk.Label(self.master, anchor=tk.W)
+        self.status.pack(side=tk.BOTTOM, fill=tk.X)
+
+        # Tabs load their data the first time they are shown
+        self.tabs.bind('<<NotebookTabChanged>>', self.show_current)
         self.tabs.pack(fill=tk.BOTH, expand=tk.TRUE)
+        self.show_current()
+
+        # Closing the window saves outstanding edits first
+        master.protocol('WM_DELETE_WINDOW', self.close)
+
+        self.mark('window')
+        master.after_idle(self.mark, 'first paint')
 
     def __del__(self):
-        del self.db
+        self.executor.shutdown()
+
+    def connect(self, report):
+        # Runs on each worker thread as it starts. Every worker checks the
+        # schema before its first job, but migrations take a lock, so only
+        # one ever runs them.
+        database = db.Database(report,
+                               backend=self.backend,
+                               migrate=False,
+                               cache=self.cache,
+                               stats=self.stats,
+                               on_write=self.on_write)
+        self.mark('connect')
+
+        database.check_schema()
+        self.mark('schema')
+
+        return database
+
+    def connected(self, ok):
+        if not ok:
+            for frame in self.frames:
+                frame.placeholder.config(text=f'Could not connect to {self.backend}')
+
+    def mark(self, name):
+        if self.timeline is not None:
+            self.timeline.mark(name)
+
+    def first_data(self, event):
+        if self.timeline is not None and 'first data' not in self.timeline.marks:
+            self.mark('first data')
+            print(self.timeline.report(), file=sys.stderr)
 
     def create_menubar(self):
         menubar = tk.Menu(self.master)
 
         filemenu = tk.Menu(menubar, tearoff=0)
         filemenu.add_command(label='Insert Test Data', command=self.insert_test_data)
+
+        importmenu = tk.Menu(filemenu, tearoff=0)
+        for kind in importer.imports:
+            importmenu.add_command(label=kind.capitalize() + '...',
+                                   command=lambda kind=kind: self.import_csv(kind))
+        filemenu.add_cascade(label='Import CSV', menu=importmenu)
+
+        exportmenu = tk.Menu(filemenu, tearoff=0)
+        for table in exporter.exports:
+            exportmenu.add_command(label=table.capitalize() + '...',
+                                   command=lambda table=table: self.export_table(table))
+        filemenu.add_cascade(label='Export', menu=exportmenu)
+
+        filemenu.add_command(label='Diagnostics', command=lambda: DiagnosticsWindow(self.master, self.stats))
         filemenu.add_separator()
-        filemenu.add_command(label='Exit', command=self.master.quit)
+        filemenu.add_command(label='Exit', command=self.close)
 
         menubar.add_cascade(label='File', menu=filemenu)
 
         return menubar
 
     def insert_test_data(self):
-        self.db.insert_test_data()
-        self.refresh()
+        self.executor.submit(lambda db: db.insert_test_data())
+
+    def import_csv(self, kind):
+        columns = ', '.join(importer.imports[kind]['columns'])
+        path = filedialog.askopenfilename(
+            parent=self.master,
+            title=f'Import {kind} ({columns})',
+            filetypes=[('CSV files', '*.csv'), ('All files', '*')])
+
+        if path:
+            ImportWindow(self.master, self.executor, kind, path)
+
+    def export_table(self, table):
+        path = filedialog.asksaveasfilename(
+            parent=self.master,
+            title=f'Export {table}',
+            initialfile=f'{table}.csv',
+            defaultextension='.csv',
+            filetypes=[('CSV files', '*.csv'), ('JSON lines', '*.jsonl')])
+
+        if not path:
+            return
+
+        def run(db):
+            try:
+                return exporter.export_table(db, table, path)
+            except (ValueError, OSError) as e:
+                return e
+
+        def finished(result):
+            if isinstance(result, Exception):
+                messagebox.showinfo('Error', f'Export failed! {result}')
+            else:
+                messagebox.showinfo('Export', f'Wrote {result} rows to {path}')
+
+        self.executor.submit(run, finished)
+
+    def current_frame(self):
+        return self.tabs.nametowidget(self.tabs.select())
+
+    def show_current(self, *args):
+        # Edits made on the tab being left are saved now rather than later
+        for frame in self.frames:
+            if frame.writes is not None:
+                frame.writes.flush()
+
+        self.current_frame().show()
+
+    def on_write(self, tables):
+        # Called on a worker thread after every successful write. The write
+        # comes back through the change feed like anyone else's, so the tabs
+        # reload from there, once - the feed is just asked to look sooner.
+        self.executor.call_soon(self.changes.poll_soon)
+
+    def save(self, changes):
+        # Where every frame's edits go - see WriteBatch
+        id = self.journal.append(changes)
+        self.replayer.wake()
+        self.show_journal(self.journal.count(), self.journal_error)
+
+        return id
+
+    def replayed(self, ids, error):
+        for frame in self.frames:
+            if frame.writes is not None:
+                frame.writes.replayed(ids, error is None)
+
+        if error is not None:
+            self.push_message_box(f'Some changes could not be saved and were set aside in '
+                                  f'{self.journal.path}: {error}')
+
+    def show_journal(self, pending, error):
+        self.journal_error = error
+
+        text = ''
+        if pending:
+            waiting = f'{pending} change{"s" if pending != 1 else ""}'
+            if error is not None:
+                text = f'Cannot reach the database ({error}) - {waiting} kept on this computer, retrying'
+            else:
+                text = f'Saving {waiting}...'
+
+        self.status.config(text=text)
+
+    def apply_changes(self, changes):
+        # Called with what any client, this one included, changed since the
+        # last poll. Only the tab on screen reloads now, the others once
+        # they are shown.
+        for table in changes:
+            self.cache.invalidate(table)
+
+        current = self.current_frame()
+        for frame in self.frames:
+            relevant = {table: rows for table, rows in changes.items()
+                        if frame.depends & db.affected_tables(table)}
+            if not relevant:
+                continue
+
+            if frame is current:
+                frame.changed(relevant)
+            else:
+                frame.dirty = True
+
+        current.show()
 
     def refresh(self):
-        self.student_frame.refresh()
-        self.course_frame.refresh()
-        self.assignment_frame.refresh()
-        self.enrollment_frame.refresh()
-        self.attendance_frame.refresh()
+        for frame in self.frames:
+            frame.dirty = True
+
+        self.show_current()
+
+    def close(self):
+        # Queued edits go into the journal, and the replayer gets a moment
+        # to finish. Whatever it has not replayed by then is replayed the
+        # next time the app starts.
+        self.changes.stop()
+        for frame in self.frames:
+            if frame.writes is not None:
+                frame.writes.flush()
+
+        self.executor.shutdown(wait=1)
+        self.replayer.stop(wait=5)
+
+        left = self.journal.count()
+        if left:
+            messagebox.showinfo('Saved on this computer',
+                                f'{left} change{"s" if left != 1 else ""} could not reach the database yet, '
+                                f'and will be saved the next time the app starts.')
+
+        self.master.destroy()
 
     def push_message_box(self, message):
         messagebox.showinfo("Error", message)
 
 if __name__ == '__main__':
+    # Slow queries are logged here as well as shown under File > Diagnostics
+    logging.basicConfig(format='%(asctime)s %(name)s %(levelname)s %(message)s')
+
+    parser = argparse.ArgumentParser(description='SIE557 project')
+    parser.add_argument('--timeline', action='store_true',
+                        help='print how long each stage of startup took')
+    args = parser.parse_args()
+
+    timeline = None
+    if args.timeline:
+        timeline = diagnostics.Timeline(started)
+        timeline.mark('imports')
+
     form = tk.Tk()
-    app = App(form)
+    app = App(form, timeline=timeline)
     form.mainloop()
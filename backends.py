@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import datetime
+import functools
+import os
+import sqlite3
+
+__author__ = 'Colin Leary'
+
+# Storage backends behind db.Database.
+#
+# A backend knows how to open a connection and everything that differs
+# between database engines - the error types, how to skip duplicate rows, how
+# to stream a result and how to look at the schema. Database itself only ever
+# writes portable SQL with %s placeholders.
+
+def error_message(e):
+    # pymysql errors carry (code, message), sqlite3 errors just the message
+    return str(e.args[-1]) if e.args else str(e)
+
+# Server error codes that mean trying again later may work: too many
+# connections, server shutting down, lock wait timeout, deadlock, and the
+# client's can't connect, server gone away and lost connection errors
+transient_mysql_errors = {1040, 1053, 1205, 1213, 2002, 2003, 2006, 2013, 2055}
+
+class MySQLBackend:
+    name = 'mysql'
+    insert_ignore = 'INSERT IGNORE'
+    explain = 'EXPLAIN '
+
+    # Reads inside a write transaction otherwise see its snapshot, and miss
+    # rows other clients committed since it began
+    locking_read = ' FOR UPDATE'
+
+    # Text columns already compare without regard to case
+    prefix_collation = ''
+
+    def __init__(self, *, host='localhost', user='python', database='sie5572020'):
+        # Only sites that use MySQL need pymysql installed
+        import pymysql
+        import pymysql.cursors
+
+        self.pymysql = pymysql
+        self.Error = pymysql.Error
+        self.IntegrityError = pymysql.IntegrityError
+        self.Warning = pymysql.Warning
+
+        self.host = host
+        self.user = user
+        self.database = database
+
+    def __str__(self):
+        return f'mysql://{self.user}@{self.host}/{self.database}'
+
+    def connect(self):
+        # Autocommit keeps long-lived read-only connections (such as
+        # background workers) from sitting on an old snapshot and never
+        # seeing new rows
+        return self.pymysql.connect(host=self.host,
+                                    user=self.user,
+                                    db=self.database,
+                                    autocommit=True)
+
+    def transient(self, e):
+        # Whether e says nothing about the statement - the server is gone,
+        # or busy - so the same statement may work later. pymysql files some
+        # statement errors under OperationalError too, hence the codes.
+        if isinstance(e, self.pymysql.InterfaceError):
+            return True
+
+        return (isinstance(e, self.pymysql.OperationalError)
+                and bool(e.args) and e.args[0] in transient_mysql_errors)
+
+    def on_conflict(self, keys, updates):
+        # Turns an INSERT into an upsert. updates maps each column to an
+        # expression, where {new} stands for the value being inserted.
+        sets = ', '.join(f'{c} = {e.format(new=f"VALUES({c})")}' for c, e in updates.items())
+        return f'ON DUPLICATE KEY UPDATE {sets}'
+
+    def streaming_cursor(self, conn):
+        # Unbuffered - rows are read from the socket as they are fetched
+        return conn.cursor(self.pymysql.cursors.SSCursor)
+
+    def columns(self, conn, table):
+        with conn.cursor() as cur:
+            cur.execute('''
+                SELECT column_name FROM information_schema.columns
+                WHERE table_schema = DATABASE() AND table_name = %s
+                ORDER BY ordinal_position
+                ''', (table,))
+
+            return [c[0] for c in cur.fetchall()]
+
+@functools.lru_cache(maxsize=512)
+def qmark(sql):
+    return sql.replace('%s', '?')
+
+class SQLiteCursor:
+    # sqlite3 cursors are not context managers and use ? placeholders, so
+    # wrap them to look like pymysql's
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cursor.close()
+
+    def execute(self, sql, params=()):
+        return self.cursor.execute(qmark(sql), tuple(params))
+
+    def executemany(self, sql, rows):
+        return self.cursor.executemany(qmark(sql), rows)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, n):
+        return tuple(self.cursor.fetchmany(n))
+
+    def fetchall(self):
+        return tuple(self.cursor.fetchall())
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+class SQLiteConnection:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self, *args):
+        return SQLiteCursor(self.conn.cursor())
+
+    def begin(self):
+        self.conn.execute('BEGIN')
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+class SQLiteBackend:
+    name = 'sqlite'
+    insert_ignore = 'INSERT OR IGNORE'
+    explain = 'EXPLAIN QUERY PLAN '
+
+    # Only one connection writes at a time, and it sees every commit
+    locking_read = ''
+
+    # LIKE ignores case, so it walks the NOCASE indexes (see migrations). A
+    # column filtered that way is sorted the same way, or the matching rows
+    # would all be sorted again before the first page.
+    prefix_collation = ' COLLATE NOCASE'
+
+    Error = sqlite3.Error
+    IntegrityError = sqlite3.IntegrityError
+    Warning = sqlite3.Warning
+
+    def __init__(self, *, path='sie5572020.sqlite3'):
+        self.path = path
+
+    def __str__(self):
+        return f'sqlite:///{os.path.abspath(self.path)}'
+
+    def connect(self):
+        # Each worker opens its own connection, but the Database that owns
+        # it may be closed from another thread
+        conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+
+        # WAL lets the UI keep reading while a worker writes
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA foreign_keys=ON')
+
+        # MySQL has BIT_COUNT built in, and attendance rates need it
+        conn.create_function('BIT_COUNT', 1, lambda n: bin(n).count('1') if n is not None else None,
+                             deterministic=True)
+
+        return SQLiteConnection(conn)
+
+    def transient(self, e):
+        # sqlite3 raises OperationalError for bad statements as well, and
+        # only the message tells a busy or missing file apart
+        return (isinstance(e, sqlite3.OperationalError)
+                and any(m in str(e) for m in ('database is locked', 'database table is locked',
+                                              'database is busy', 'unable to open database')))
+
+    def on_conflict(self, keys, updates):
+        sets = ', '.join(f'{c} = {e.format(new=f"excluded.{c}")}' for c, e in updates.items())
+        return f'ON CONFLICT ({", ".join(keys)}) DO UPDATE SET {sets}'
+
+    def streaming_cursor(self, conn):
+        # sqlite3 cursors already step through results as they are fetched
+        return conn.cursor()
+
+    def columns(self, conn, table):
+        with conn.cursor() as cur:
+            cur.execute(f'PRAGMA table_info({table})')
+            return [c[1] for c in cur.fetchall()]
+
+# Store dates the way MySQL hands them back in text form
+sqlite3.register_adapter(datetime.date, lambda d: d.isoformat())
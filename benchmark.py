@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import backends
+import datagen
+import db
+
+__author__ = 'Colin Leary'
+
+# Benchmarks for the data layer, run without any UI.
+#
+# Each case runs the same Database calls a frame makes when it refreshes, so
+# a change to a query shows up here exactly as the app would see it. Results
+# are written as JSON so runs from different commits can be compared with
+# --compare.
+#
+# The benchmark builds its own database (sie5572020_bench by default, or a
+# SQLite file with --sqlite) and fills it with datagen at each scale, so it
+# never touches real data.
+
+def percentile(values, p):
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def run_case(func, params, repeat):
+    # func(param) -> rows. Each param is run repeat times.
+    times = []
+    rows = 0
+
+    tracemalloc.start()
+    for i in range(repeat):
+        for param in params:
+            start = time.perf_counter()
+            result = func(param)
+            times.append(time.perf_counter() - start)
+            rows += len(result)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    total = sum(times)
+
+    return {
+        'runs': len(times),
+        'rows': rows,
+        'p50_ms': percentile(times, 50) * 1000,
+        'p95_ms': percentile(times, 95) * 1000,
+        'p99_ms': percentile(times, 99) * 1000,
+        'max_ms': max(times) * 1000,
+        'mean_ms': statistics.mean(times) * 1000,
+        'rows_per_s': rows / total if total > 0 else 0,
+        'peak_kb': peak / 1024,
+    }
+
+def roster_date(rng, term):
+    # Generated terms have known class days - anything else just uses today
+    try:
+        return rng.choice(datagen.class_days(term, 10))
+    except ValueError:
+        return datetime.date.today()
+
+def cases(database, rng, samples):
+    # Pick the terms, courses and dates the cases run against
+    terms = [t[0] for t in database.get_terms()]
+    offerings = []
+    for term in rng.sample(terms, min(len(terms), samples)):
+        courses = database.get_term_courses(term)
+        if courses:
+            offerings.append((term, rng.choice(courses)[1]))
+
+    rosters = [(term, course_id, roster_date(rng, term))
+               for term, course_id in offerings]
+
+    total = database.count('students')
+    offsets = [rng.randrange(max(total, 1)) for i in range(samples)]
+
+    def entity_refresh(table):
+        # EntityFrame.refresh - the row count, then the first page
+        return database.get_page(table, ['name'], limit=200) + ((database.count(table),),)
+
+    def enrollment_refresh(offering):
+        term, course_id = offering
+        return database.get_terms() + database.get_term_courses(term) + database.get_enrolled(term, course_id)
+
+    def attendance_refresh(roster):
+        term, course_id, date = roster
+        return database.get_terms() + database.get_term_courses(term) + database.get_roster(term, course_id, date)
+
+    def deep_page(offset):
+        return database.get_page('students', ['name'],
+                                 after=database.get_page_key('students', offset),
+                                 limit=200)
+
+    return {
+        'students.get_all': (lambda p: database.get('students', ['id', 'name']), [None]),
+        'students.count': (lambda p: ((database.count('students'),),), [None]),
+        'students.first_page': (lambda p: database.get_page('students', ['name'], limit=200), [None]),
+        'students.deep_page': (deep_page, offsets),
+        'entity.refresh': (entity_refresh, ['students']),
+        'enrollment.terms': (lambda p: database.get_terms(), [None]),
+        'enrollment.courses': (lambda p: database.get_term_courses(p[0]), offerings),
+        'enrollment.students': (lambda p: database.get_enrolled(*p), offerings),
+        'enrollment.refresh': (enrollment_refresh, offerings),
+        'attendance.roster': (lambda p: database.get_roster(*p), rosters),
+        'attendance.refresh': (attendance_refresh, rosters),
+    }
+
+def backend(args):
+    if args.sqlite:
+        return backends.SQLiteBackend(path=args.sqlite)
+
+    return backends.MySQLBackend(host=args.host, user=args.user, database=args.database)
+
+def build(args, scale):
+    # The benchmark database is dropped and rebuilt for every scale
+    if args.sqlite:
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(args.sqlite + suffix):
+                os.remove(args.sqlite + suffix)
+    else:
+        if args.database == 'sie5572020':
+            raise SystemExit('Refusing to rebuild the application database - use --no-generate')
+
+        import pymysql
+
+        conn = pymysql.connect(host=args.host, user=args.user)
+        with conn.cursor() as cur:
+            cur.execute(f'DROP DATABASE IF EXISTS {db.identifier(args.database)}')
+            cur.execute(f'CREATE DATABASE {db.identifier(args.database)}')
+        conn.close()
+
+    database = db.Database(print, backend=backend(args))
+
+    start = time.perf_counter()
+    counts = datagen.generate(database, scale, seed=args.seed)
+    print(f'  generated {sum(counts.values())} rows in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+
+    return counts
+
+def run(args):
+    results = {
+        'commit': commit(),
+        'started': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'repeat': args.repeat,
+        'cached': args.cache,
+        'backend': 'sqlite' if args.sqlite else 'mysql',
+        'scales': {},
+    }
+
+    for scale in args.scales:
+        print(f'{scale}:', file=sys.stderr)
+
+        counts = None if args.no_generate else build(args, scale)
+
+        # With no cache every run goes to the server
+        cache = db.QueryCache() if args.cache else db.QueryCache(max_entries=0)
+        database = db.Database(print, backend=backend(args), cache=cache)
+
+        rng = random.Random(args.seed)
+        scale_results = {'rows': counts, 'cases': {}}
+
+        for name, (func, params) in cases(database, rng, args.samples).items():
+            if not params:
+                continue
+
+            r = run_case(func, params, args.repeat)
+            scale_results['cases'][name] = r
+            print(f'  {name:24} p50 {r["p50_ms"]:9.2f}ms  p95 {r["p95_ms"]:9.2f}ms  '
+                  f'{r["rows_per_s"]:12.0f} rows/s  peak {r["peak_kb"]:9.1f}KB', file=sys.stderr)
+
+        results['scales'][scale] = scale_results
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if args.compare:
+        compare(args.compare, results)
+
+def compare(path, new):
+    with open(path) as f:
+        old = json.load(f)
+
+    print(f'Compared with {old.get("commit")} (p50, new / old):')
+    for scale, scale_results in new['scales'].items():
+        old_cases = old['scales'].get(scale, {}).get('cases', {})
+
+        for name, r in scale_results['cases'].items():
+            if name in old_cases and old_cases[name]['p50_ms'] > 0:
+                ratio = r['p50_ms'] / old_cases[name]['p50_ms']
+                flag = '  <-- slower' if ratio > 1.2 else ''
+                print(f'  {scale:8} {name:24} {ratio:6.2f}x{flag}')
+
+def commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the data layer')
+    parser.add_argument('--scales', nargs='+', default=['small', 'medium'],
+                        choices=sorted(datagen.presets))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--samples', type=int, default=20,
+                        help='terms/courses/offsets to sample per case')
+    parser.add_argument('--seed', type=int, default=557)
+    parser.add_argument('--cache', action='store_true',
+                        help='leave the query cache on')
+    parser.add_argument('--no-generate', action='store_true',
+                        help='run against whatever is already in the database')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--user', default='python')
+    parser.add_argument('--database', default='sie5572020_bench')
+    parser.add_argument('--sqlite', metavar='PATH',
+                        help='benchmark an embedded SQLite file instead of MySQL')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', help='earlier results to compare against')
+
+    run(parser.parse_args())
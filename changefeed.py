@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+
+import time
+
+__author__ = 'Colin Leary'
+
+# Follows the changelog, so a client sees what other clients changed.
+#
+# Triggers log every write to a table the app shows (see migrations), and
+# every few seconds this asks for the entries after the last one it saw - a
+# range scan on the key that returns nothing when nobody has written. New
+# entries are handed over as table -> {row id: op}, op being 'I', 'U' or
+# 'D', for the frames to apply just those rows.
+#
+# Entry ids are handed out when a trigger runs, not when its transaction
+# commits, so a lower id can turn up after a higher one has been seen. The
+# feed only moves last_id over ids it has seen, and keeps asking from there
+# - skipping the entries above it that were already handed over - until a
+# missing id has stayed missing for gap_ms (its transaction rolled back, or
+# the server skipped it).
+#
+# The log is trimmed to the newest keep entries now and then. A client that
+# falls further behind than that (or more than limit entries behind, which
+# any client that missed trimmed entries is) is told it lost track instead,
+# and starts again from the newest entry once it has reloaded.
+#
+# A client's own writes come back through here too, which is how its tabs
+# learn about them - poll_soon asks for them without waiting the interval.
+#
+# While the database cannot be reached the feed keeps polling at the usual
+# interval. on_lost is called once when it goes, and once more when it is
+# back, since whatever the tabs tried to load in between never arrived.
+class ChangeFeed:
+    def __init__(self, master, executor, on_changes, on_lost, *, interval_ms=3000, soon_ms=200,
+                 gap_ms=30000, limit=1000, keep=10000, trim_every=100):
+        self.master = master
+        self.executor = executor
+        self.on_changes = on_changes
+        self.on_lost = on_lost
+        self.interval_ms = interval_ms
+        self.soon_ms = soon_ms
+        self.gap_ms = gap_ms
+        self.limit = limit
+        self.keep = keep
+        self.trim_every = trim_every
+
+        self.last_id = None
+        self.running = False
+
+        # Ids above last_id already handed over, and (highest id seen, when)
+        # for each poll that saw a new highest id
+        self.seen = set()
+        self.marks = []
+        self.down = False
+        self.polls = 0
+        self.timer = None
+
+        # A poll is due shortly rather than at the interval, or should be
+        # once the one in flight is back
+        self.soon = False
+        self.hurry = False
+
+    def start(self):
+        # Only what changes from now on matters
+        self.running = False
+        self.executor.submit(lambda db: db.last_change(), self.started, key=(self, 'poll'),
+                             on_error=self.unavailable)
+
+    def started(self, last_id):
+        self.last_id = last_id
+        self.seen = set()
+        self.marks = []
+        self.running = True
+        self.reachable()
+        self.schedule()
+
+    def unavailable(self, error):
+        if not self.down:
+            self.down = True
+            self.on_lost()
+
+        self.schedule()
+
+    def reachable(self):
+        if self.down:
+            self.down = False
+            self.on_lost()
+
+    def stop(self):
+        if self.timer is not None:
+            self.master.after_cancel(self.timer)
+            self.timer = None
+
+        self.executor.cancel((self, 'poll'))
+
+    def schedule(self):
+        if self.hurry:
+            self.hurry = False
+            self.soon = True
+            self.timer = self.master.after(self.soon_ms, self.poll)
+        else:
+            self.timer = self.master.after(self.interval_ms, self.poll)
+
+    def poll_soon(self):
+        # This client just wrote something. It shows up after a short pause
+        # instead of the full interval, and a burst of writes (such as an
+        # import) still only makes one poll.
+        if self.timer is None:
+            self.hurry = True
+        elif not self.soon:
+            self.master.after_cancel(self.timer)
+            self.soon = True
+            self.timer = self.master.after(self.soon_ms, self.poll)
+
+    def poll(self):
+        self.timer = None
+        self.soon = False
+
+        # Never got as far as starting
+        if not self.running:
+            self.start()
+            return
+
+        self.polls += 1
+
+        last_id = self.last_id
+        trim = self.polls % self.trim_every == 0
+
+        def work(db):
+            changes = db.get_changes(last_id, self.limit + 1)
+            if trim:
+                db.prune_changes(self.keep)
+
+            return changes
+
+        self.executor.submit(work, self.received, key=(self, 'poll'), on_error=self.unavailable)
+
+    def received(self, changes):
+        self.reachable()
+
+        if len(changes) > self.limit:
+            self.on_lost()
+            self.start()
+            return
+
+        changes = [change for change in changes if change[0] not in self.seen]
+        if changes:
+            self.seen.update(change[0] for change in changes)
+            top = max(self.seen)
+            if not self.marks or top > self.marks[-1][0]:
+                self.marks.append((top, time.monotonic()))
+
+        self.advance()
+
+        if changes:
+            tables = {}
+            for id, table, row_id, op in changes:
+                rows = tables.setdefault(table, {})
+
+                # A row added and changed since the last poll is still new
+                if rows.get(row_id) != 'I' or op == 'D':
+                    rows[row_id] = op
+
+            self.on_changes(tables)
+
+        self.schedule()
+
+    def advance(self):
+        # Every id up to a highest id seen gap_ms ago has had that long to
+        # turn up, and is given up on if it has not. Beyond that, last_id
+        # only moves through ids that have been seen.
+        now = time.monotonic()
+        last_id = max([self.last_id] + [top for top, when in self.marks
+                                         if (now - when) * 1000 >= self.gap_ms])
+        while last_id + 1 in self.seen:
+            last_id += 1
+
+        self.last_id = last_id
+        self.seen = {id for id in self.seen if id > last_id}
+        self.marks = [(top, when) for top, when in self.marks if top > last_id]
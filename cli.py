@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+import argparse
+import sys
+
+__author__ = 'Colin Leary'
+
+# Command line entry point for bulk jobs, so scripts and nightly runs do not
+# need a display.
+#
+# Nothing here imports tkinter, and each command only imports the modules it
+# needs once it runs, so starting up costs little more than the interpreter
+# itself. The database is the one the app uses (see config), or --config.
+#
+#   python3 cli.py import students students.csv
+#   python3 cli.py import attendance marks.csv
+#   python3 cli.py export enrollment enrollment.jsonl
+#   python3 cli.py report at-risk 'Fall 2019' --threshold 0.75
+#   python3 cli.py report grades 'Fall 2019' 12
+#   python3 cli.py datagen --size medium
+#
+# Reports are written to stdout as CSV, everything else to stderr. The exit
+# status is 1 if anything failed.
+
+failed = False
+
+def error(message):
+    global failed
+    failed = True
+    print(message, file=sys.stderr)
+
+def connect(args):
+    import config
+    import db
+
+    try:
+        backend = config.backend(config.load(args.config))
+    except (ValueError, ImportError) as e:
+        error(str(e))
+        sys.exit(1)
+
+    database = db.Database(error, backend=backend)
+    if database.conn is None:
+        sys.exit(1)
+
+    return database
+
+def write_rows(header, rows):
+    import csv
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(header)
+    writer.writerows(rows)
+
+def do_import(args):
+    import importer
+
+    database = connect(args)
+    try:
+        result = importer.import_csv(database, args.kind, args.path, chunk_size=args.chunk_size)
+    except (ValueError, OSError) as e:
+        error(str(e))
+        return
+
+    print(result, file=sys.stderr)
+    if result.failed_chunks:
+        error(f'{result.failed_chunks} chunks were not saved')
+
+def do_export(args):
+    import exporter
+
+    try:
+        n = exporter.export_table(connect(args), args.table, args.path, fmt=args.format)
+    except (ValueError, OSError) as e:
+        error(str(e))
+        return
+
+    print(f'Wrote {n} rows to {args.path}', file=sys.stderr)
+
+def do_report(args):
+    database = connect(args)
+
+    if args.report == 'at-risk':
+        students = database.get_at_risk(args.term, args.threshold)
+        write_rows(['enrollment_id', 'student', 'course', 'days_present', 'class_days', 'rate'],
+                   [(e_id, name, course, present, days, f'{present / days:.3f}')
+                    for e_id, name, course, present, days in students])
+
+    elif args.report == 'attendance':
+        students = database.get_attendance_rates(args.term, args.course_id)
+        write_rows(['enrollment_id', 'student', 'days_present', 'class_days', 'rate'],
+                   [(e_id, name, present, days, f'{present / days:.3f}' if days else '')
+                    for e_id, name, present, days in students])
+
+    elif args.report == 'grades':
+        # NumPy is only needed for this report
+        try:
+            import gradestats
+        except ImportError:
+            error('The grades report needs NumPy')
+            return
+
+        grades = database.get_course_grades(args.term, args.course_id)
+        if not grades:
+            error('No grades recorded for that course')
+            return
+
+        stats = gradestats.course_stats(grades)
+        write_rows(['assignment_id', 'count', 'mean', 'median']
+                   + [f'p{p}' for p in gradestats.percentiles],
+                   [(a_id, count, f'{mean:.2f}', f'{median:.2f}', *(f'{p:.2f}' for p in percentiles))
+                    for a_id, count, mean, median, percentiles, histogram in stats.assignment_rows()])
+
+def do_datagen(args):
+    import datagen
+
+    database = connect(args)
+
+    progress = None
+    if sys.stderr.isatty():
+        progress = lambda table, n: print(f'\r{table}: {n:<12}', end='', file=sys.stderr)
+
+    try:
+        counts = database.insert_test_data(args.size, seed=args.seed, progress=progress)
+    except datagen.GenerateFailed as e:
+        error(str(e))
+        return
+    finally:
+        if progress is not None:
+            print(file=sys.stderr)
+
+    for table, n in counts.items():
+        print(f'{table}: {n}', file=sys.stderr)
+
+def parser():
+    # The choices are spelled out here rather than read from importer and
+    # exporter, so --help does not have to import them
+    parser = argparse.ArgumentParser(description='Bulk operations on the SIE557 database')
+    parser.add_argument('--config', help='settings file (default sie557.ini or $SIE557_CONFIG)')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    p = commands.add_parser('import', help='import a CSV file')
+    p.add_argument('kind', choices=['students', 'courses', 'assignments', 'enrollments', 'attendance'])
+    p.add_argument('path')
+    p.add_argument('--chunk-size', type=int, default=5000)
+    p.set_defaults(func=do_import)
+
+    p = commands.add_parser('export', help='export a table to CSV or JSON lines')
+    p.add_argument('table', choices=['students', 'courses', 'assignments', 'enrollment', 'attendance', 'grades'])
+    p.add_argument('path')
+    p.add_argument('--format', choices=['csv', 'jsonl'],
+                   help='default from the file extension')
+    p.set_defaults(func=do_export)
+
+    p = commands.add_parser('report', help='print a report as CSV')
+    reports = p.add_subparsers(dest='report', required=True)
+
+    r = reports.add_parser('at-risk', help='students attending less than the threshold')
+    r.add_argument('term')
+    r.add_argument('--threshold', type=float, default=0.8)
+
+    r = reports.add_parser('attendance', help="a course's attendance rates")
+    r.add_argument('term')
+    r.add_argument('course_id', type=int)
+
+    r = reports.add_parser('grades', help="a course's grade statistics")
+    r.add_argument('term')
+    r.add_argument('course_id', type=int)
+
+    p.set_defaults(func=do_report)
+
+    p = commands.add_parser('datagen', help='fill the database with generated test data')
+    p.add_argument('--size', choices=['small', 'medium', 'large'], default='small')
+    p.add_argument('--seed', type=int, default=557)
+    p.set_defaults(func=do_datagen)
+
+    return parser
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+
+    # Every command uses the database
+    import db
+
+    try:
+        args.func(args)
+    except db.Unavailable as e:
+        error(f'Lost the connection to the database: {e}')
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+
+import configparser
+import os
+
+import backends
+
+__author__ = 'Colin Leary'
+
+# Site configuration, read from sie557.ini (or the file named by
+# SIE557_CONFIG). Everything has a default, so with no file at all the app
+# uses the MySQL server it always has. An embedded database instead needs
+# just:
+#
+#   [database]
+#   backend = sqlite
+#   path = sie5572020.sqlite3
+#
+# Edits wait in a journal on this computer until they reach the database
+# (see journal); [journal] path says where.
+
+defaults = {
+    'database': {
+        'backend': 'mysql',
+        'host': 'localhost',
+        'user': 'python',
+        'database': 'sie5572020',
+        'path': 'sie5572020.sqlite3',
+    },
+    'journal': {
+        'path': 'sie557-journal.sqlite3',
+    },
+}
+
+def load(path=None):
+    if path is None:
+        path = os.environ.get('SIE557_CONFIG', 'sie557.ini')
+
+    parser = configparser.ConfigParser()
+    parser.read_dict(defaults)
+    parser.read(path)
+
+    return parser
+
+def backend(parser=None):
+    if parser is None:
+        parser = load()
+
+    section = parser['database']
+    name = section['backend']
+
+    if name == 'mysql':
+        return backends.MySQLBackend(host=section['host'],
+                                     user=section['user'],
+                                     database=section['database'])
+    if name == 'sqlite':
+        return backends.SQLiteBackend(path=section['path'])
+
+    raise ValueError(f'Unknown database backend: {name!r}')
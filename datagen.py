@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+
+import datetime
+import random
+
+__author__ = 'Colin Leary'
+
+# Seeded generator for synthetic data sets.
+#
+# The same seed and sizes always produce the same rows, so data sets can be
+# rebuilt exactly for benchmarking. Rows are generated lazily and written in
+# batched multi-row inserts, one commit per chunk, so memory stays flat even
+# for tens of millions of rows. Everything is inserted with duplicates
+# ignored, so running it again over the same database is harmless.
+
+presets = {
+    # Roughly what Insert Test Data has always produced
+    'small': {
+        'students': 10,
+        'courses': 10,
+        'assignments': 10,
+        'terms': 6,
+        'courses_per_term': 6,
+        'class_size': 6,
+        'days_per_term': 10,
+        'attendance_rate': 0.85,
+        'graded_assignments': 3,
+    },
+    'medium': {
+        'students': 20000,
+        'courses': 500,
+        'assignments': 50,
+        'terms': 8,
+        'courses_per_term': 200,
+        'class_size': 40,
+        'days_per_term': 45,
+        'attendance_rate': 0.85,
+        'graded_assignments': 5,
+    },
+    'large': {
+        'students': 500000,
+        'courses': 5000,
+        'assignments': 200,
+        'terms': 40,
+        'courses_per_term': 1000,
+        'class_size': 50,
+        'days_per_term': 45,
+        'attendance_rate': 0.85,
+        'graded_assignments': 5,
+    },
+}
+
+first_names = ['Fariha', 'Giovanni', 'Lyla-Rose', 'Nolan', 'Aarush',
+               'Akeel', 'Riaan', 'Cain', 'Caitlyn', 'Luc']
+last_names = ['Quinn', 'Hagan', 'Wyatt', 'Knights', 'Mullen',
+              'Mccarty', 'Mason', 'Nichols', 'Horn', 'Park']
+
+course_names = ['Alien Bioengineering', 'Planetary Biology', 'Life Gardening',
+                'Foreign Drama', 'Alien Mathematics', 'Alien Ethics',
+                'Extinct Language Literature', 'Alien Biology',
+                'Alien Tactics and Strategy', 'Ward Casting']
+instructors = ['Acacia Bob', 'Shyla Molloy', 'Lorena Archer', 'Carys Joyce',
+               'Gurveer Hicks', 'Susie Adams', 'Henry Mcnamara',
+               'Henrietta Person', 'Krista Miranda', 'Tasnia Avery']
+
+def student_name(i):
+    n = len(first_names)
+    name = f'{first_names[i % n]} {last_names[(i // n + i) % n]}'
+
+    # Once every first/last pairing is used, number them to stay unique
+    if i >= n * n:
+        name += f' {i // (n * n)}'
+
+    return name
+
+def course(i):
+    n = len(course_names)
+    name = course_names[i % n]
+    if i >= n:
+        name = f'{name[:24]} {100 + i // n}'
+
+    return instructors[(i + i // n) % n], name
+
+def term_name(i):
+    # Counting back from Spring 2020, alternating Spring and Fall
+    year = 2020 - (i + 1) // 2
+    return f'Spring {year}' if i % 2 == 0 else f'Fall {year}'
+
+def class_days(term, n):
+    season, year = term.split()
+    day = datetime.date(int(year), 1, 13) if season == 'Spring' else datetime.date(int(year), 9, 2)
+
+    days = []
+    while len(days) < n:
+        if day.weekday() < 5:
+            days.append(day)
+        day += datetime.timedelta(days=1)
+
+    return days
+
+class GenerateFailed(Exception):
+    pass
+
+def chunked(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+def load(db, table, columns, rows, chunk_size, progress):
+    # The number of rows inserted - on a rerun, rows already there are
+    # skipped and not counted
+    n = 0
+    for chunk in chunked(rows, chunk_size):
+        inserted = db.insert(table, columns, chunk, ignore_duplicates=True)
+        if inserted is None:
+            # Database has said why, and the later tables need these rows
+            raise GenerateFailed(f'Could not insert {table}')
+        n += inserted
+
+        if progress is not None:
+            progress(table, n)
+
+    return n
+
+def generate(db, sizes='small', *, seed=557, chunk_size=10000, progress=None):
+    if isinstance(sizes, str):
+        sizes = presets[sizes]
+    else:
+        sizes = dict(presets['small'], **sizes)
+
+    rng = random.Random(seed)
+    counts = {}
+
+    counts['students'] = load(db, 'students', ['name'],
+                              ((student_name(i),) for i in range(sizes['students'])),
+                              chunk_size, progress)
+
+    counts['courses'] = load(db, 'courses', ['instructor_name', 'course_name'],
+                             (course(i) for i in range(sizes['courses'])),
+                             chunk_size, progress)
+
+    counts['assignments'] = load(db, 'assignments', ['name'],
+                                 ((f'Homework {i+1}',) for i in range(sizes['assignments'])),
+                                 chunk_size, progress)
+
+    # Work from ids in a fixed order so the same seed always picks the same
+    # students and courses
+    student_ids = [r[0] for r in db.get('students', ['id'], order_by='id')]
+    course_ids = [r[0] for r in db.get('courses', ['id'], order_by='id')]
+    assignment_ids = [r[0] for r in db.get('assignments', ['id'], order_by='id')]
+
+    graded = assignment_ids[:sizes['graded_assignments']]
+    courses_per_term = min(sizes['courses_per_term'], len(course_ids))
+    class_size = min(sizes['class_size'], len(student_ids))
+
+    counts['enrollment_data'] = 0
+    counts['attendance'] = 0
+    counts['grades'] = 0
+
+    for t in range(sizes['terms']):
+        term = term_name(t)
+
+        def enrollments():
+            for c_id in rng.sample(course_ids, courses_per_term):
+                for s_id in rng.sample(student_ids, class_size):
+                    yield term, c_id, s_id
+
+        counts['enrollment_data'] += load(db, 'enrollment_data',
+                                          ['term', 'course_id', 'student_id'],
+                                          enrollments(),
+                                          chunk_size, progress)
+
+        enrollment_ids = [r[0] for r in db.get('enrollment_data', ['id'],
+                                               where={'term': term},
+                                               order_by='id')]
+        days = class_days(term, sizes['days_per_term'])
+        rate = sizes['attendance_rate']
+
+        def attendance():
+            for e_id in enrollment_ids:
+                for day in days:
+                    if rng.random() < rate:
+                        yield e_id, day
+
+        counts['attendance'] += load(db, 'attendance', ['enrollment_id', 'date'],
+                                     attendance(),
+                                     chunk_size, progress)
+
+        def grades():
+            for e_id in enrollment_ids:
+                for a_id in graded:
+                    yield a_id, e_id, rng.randint(40, 100)
+
+        counts['grades'] += load(db, 'grades', ['assignment_id', 'enrollment_id', 'score'],
+                                 grades(),
+                                 chunk_size, progress)
+
+    return counts
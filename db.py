@@ -1,294 +1,983 @@
 #!/usr/bin/env python3
 
-import warnings
-import pymysql.cursors
-import random
+from collections import OrderedDict
+import functools
+import re
+import threading
+import time
+
+import backends
+import datagen
+import diagnostics
+import migrations
 
 __author__ = 'Colin Leary'
 
+# Table and column names cannot be passed as parameters, so anything that is
+# spliced into a statement has to look like a plain identifier
+IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+ORDERING = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*( (ASC|DESC))?$')
+OPERATORS = ('=', '!=', '<', '<=', '>', '>=', 'LIKE', 'IN', 'PREFIX')
+
+# A write lost out to other clients writing the same rows more often than is
+# worth retrying straight away. Nothing was saved, and trying the whole batch
+# again later will work.
+class Contention(Exception):
+    pass
+
+# The database cannot be reached right now - there is no connection, or it
+# was just lost. Nothing was read or saved, and the same call may work later.
+class Unavailable(ConnectionError):
+    pass
+
+def identifier(name):
+    if not IDENTIFIER.match(name):
+        raise ValueError(f'Not a valid identifier: {name!r}')
+
+    return name
+
+def predicates(where):
+    # Predicates are given either as a dict of column -> value, which matches
+    # on equality (or IN for a list), or as a list of (column, op, value).
+    # PREFIX matches values starting with the given text. A pair of columns
+    # compared with < or > to a pair of values compares them in order, as a
+    # keyset.
+    if where is None:
+        return []
+
+    if isinstance(where, dict):
+        return [(col, 'IN' if isinstance(value, (list, tuple, set)) else '=', value)
+                for col, value in where.items()]
+
+    return list(where)
+
+def predicate_shape(where):
+    # Split predicates into their shape, which decides the statement text,
+    # and the values, which are passed as parameters
+    shape = []
+    params = []
+
+    for col, op, value in predicates(where):
+        if op not in OPERATORS:
+            raise ValueError(f'Unsupported operator: {op!r}')
+
+        if isinstance(col, tuple):
+            # (a, b) > (x, y) as a >= x AND (a > x OR b > y), which unlike a
+            # row comparison can use an index on a everywhere
+            if len(col) != 2 or op not in ('<', '>'):
+                raise ValueError(f'Unsupported keyset comparison: {col!r} {op}')
+
+            shape.append((col, op, 3))
+            params.extend([value[0], value[0], value[1]])
+        elif op == 'IN':
+            value = list(value)
+            shape.append((col, op, len(value)))
+            params.extend(value)
+        elif op == 'PREFIX':
+            # A LIKE pattern that can use an index on the column
+            value = re.sub(r'([!%_])', r'!\1', value) + '%'
+            shape.append((col, op, 1))
+            params.append(value)
+        else:
+            shape.append((col, op, 1))
+            params.append(value)
+
+    return tuple(shape), params
+
+def prefix_columns(shape):
+    return {col for col, op, n in shape if op == 'PREFIX'}
+
+def compile_where(shape, collate=''):
+    # collate is added to keyset comparisons on a PREFIX filtered column, to
+    # match the order compile_select sorts them in
+    if not shape:
+        return ''
+
+    clauses = []
+    for col, op, n in shape:
+        if isinstance(col, tuple):
+            a, b = (identifier(c) for c in col)
+            if a in prefix_columns(shape):
+                a += collate
+            clauses.append(f'{a} {op}= %s AND ({a} {op} %s OR {b} {op} %s)')
+        elif op == 'PREFIX':
+            clauses.append(f"{identifier(col)} LIKE %s ESCAPE '!'")
+        elif op != 'IN':
+            clauses.append(f'{identifier(col)} {op} %s')
+        elif n == 0:
+            clauses.append('1 = 0')
+        else:
+            clauses.append(f'{identifier(col)} IN ({", ".join(["%s"] * n)})')
+
+    return ' WHERE ' + ' AND '.join(clauses)
+
+# Statement text is cached by table, columns and predicate shape so repeated
+# queries skip rebuilding (and revalidating) the SQL
+@functools.lru_cache(maxsize=256)
+def compile_select(table, columns, shape, distinct, order_by, limit, offset, collate=''):
+    # collate is the backend's prefix_collation. A column that is both
+    # PREFIX filtered and sorted on is sorted with it, so the filter and the
+    # order can use the same index.
+    cols = ', '.join(c if c == 'COUNT(*)' else identifier(c) for c in columns)
+
+    select_sql = f'SELECT {"DISTINCT " if distinct else ""}{cols} FROM {identifier(table)}'
+    select_sql += compile_where(shape, collate)
+
+    if order_by:
+        ordering = []
+        for o in order_by:
+            if not ORDERING.match(o):
+                raise ValueError(f'Not a valid ordering: {o!r}')
+
+            col, _, direction = o.partition(' ')
+            if col in prefix_columns(shape):
+                o = col + collate + (' ' + direction if direction else '')
+            ordering.append(o)
+
+        select_sql += ' ORDER BY ' + ', '.join(ordering)
+
+    if limit:
+        select_sql += ' LIMIT %s'
+        if offset:
+            select_sql += ' OFFSET %s'
+
+    return select_sql
+
+@functools.lru_cache(maxsize=256)
+def compile_insert(table, columns, verb):
+    # verb is INSERT, or the backend's way of skipping duplicate rows
+    cols = ', '.join(identifier(c) for c in columns)
+    values = ', '.join(['%s'] * len(columns))
+
+    return f'{verb} INTO {identifier(table)} ({cols}) VALUES ({values})'
+
+@functools.lru_cache(maxsize=256)
+def compile_delete(table, shape):
+    # Never delete without a WHERE
+    if not shape:
+        raise ValueError('Refusing to delete without a predicate')
+
+    return f'DELETE FROM {identifier(table)}{compile_where(shape)}'
+
+# Tables that can be upserted into, and the key a row is replaced on
+primary_keys = {
+    'grades': ('enrollment_id', 'assignment_id'),
+}
+
+# Which tables each table or view reads from. A write to any of them makes
+# cached reads of the table stale. Deletes cascade through the foreign keys,
+# so a write to a parent table also touches its children.
+dependencies = {
+    'enrollment': ['enrollment_data', 'courses', 'students'],
+}
+
+# Inserting a row that is already there is harmless for these - an
+# enrollment or a mark says no more than that it exists - so batches given to
+# apply skip such rows. Anywhere else a duplicate is a clash (a second
+# student with the same name) and fails the batch.
+idempotent_inserts = {'enrollment_data', 'attendance'}
+
+cascades = {
+    'students': ['enrollment_data'],
+    'courses': ['enrollment_data'],
+    'assignments': ['grades'],
+    'enrollment_data': ['attendance', 'grades', 'terms', 'term_courses'],
+    # Writes to the attendance view land in these
+    'attendance': ['attendance_bits', 'term_calendar', 'attendance_summary', 'course_calendar'],
+}
+
+def affected_tables(table):
+    # Every table changed, directly or by cascade, by a write to table
+    tables = {table}
+    pending = [table]
+
+    while pending:
+        for child in cascades.get(pending.pop(), []):
+            if child not in tables:
+                tables.add(child)
+                pending.append(child)
+
+    return tables
+
+# Read-through cache of query results, keyed by statement text and parameters.
+#
+# Entries remember which base tables they read, and any write to one of those
+# tables drops them. Each table also has a version number, bumped on every
+# write, so a read that raced with a write is never stored. One cache can be
+# shared by several Database objects (such as background workers) so that a
+# write through one connection invalidates reads cached by the others.
+#
+# Writes made by other clients only show up here once the change feed (see
+# changefeed) sees them, so entries also expire after max_age seconds.
+class QueryCache:
+    def __init__(self, *, max_entries=512, max_rows=5000, max_age=30.0):
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self.max_age = max_age
+
+        self.entries = OrderedDict()
+        self.by_table = {}
+        self.versions = {}
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def tables_for(self, tables):
+        base = set()
+        for table in tables:
+            base.update(dependencies.get(table, [table]))
+
+        return frozenset(base)
+
+    def snapshot(self, tables):
+        with self.lock:
+            return tuple(self.versions.get(t, 0) for t in sorted(tables))
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.monotonic() - entry[2] < self.max_age:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            self.misses += 1
+            return None
+
+    def put(self, key, tables, snapshot, rows):
+        if len(rows) > self.max_rows:
+            return
+
+        with self.lock:
+            # Something was written while the query ran
+            if tuple(self.versions.get(t, 0) for t in sorted(tables)) != snapshot:
+                return
+
+            self.entries[key] = (tables, rows, time.monotonic())
+            self.entries.move_to_end(key)
+            for t in tables:
+                self.by_table.setdefault(t, set()).add(key)
+
+            while len(self.entries) > self.max_entries:
+                old_key, old_entry = self.entries.popitem(last=False)
+                for t in old_entry[0]:
+                    self.by_table.get(t, set()).discard(old_key)
+
+    def invalidate(self, table):
+        with self.lock:
+            for t in affected_tables(table):
+                self.versions[t] = self.versions.get(t, 0) + 1
+
+                for key in self.by_table.pop(t, set()):
+                    entry = self.entries.pop(key, None)
+                    if entry is not None:
+                        for other in entry[0]:
+                            self.by_table.get(other, set()).discard(key)
+
+    def clear(self):
+        with self.lock:
+            for t in list(self.by_table) + list(self.versions):
+                self.versions[t] = self.versions.get(t, 0) + 1
+
+            self.entries.clear()
+            self.by_table.clear()
+
 class Database:
-    def __init__(self, print_func):
+    def __init__(self, print_func, *, backend=None, migrate=True, cache=None, stats=None, on_write=None):
         self.conn = None
+        self.backend = backend if backend is not None else backends.MySQLBackend()
         self.print_func = print_func
+        self.cache = cache if cache is not None else QueryCache()
+        self.stats = stats if stats is not None else diagnostics.QueryStats()
+
+        # on_write(tables) is told about every successful write, with every
+        # table it may have changed
+        self.on_write = on_write
 
         # Attempt to open the database
         try:
-            self.conn = pymysql.connect(host='localhost',
-                                        user='python',
-                                        db='sie5572020')
+            self.conn = self.backend.connect()
+        except self.backend.Error as e:
+            self.print_func('Cannot open database' + backends.error_message(e))
+
+        if migrate:
+            self.check_schema()
+
+    def __del__(self):
+        if self.conn is not None:
+            self.conn.close()
+
+    def connection(self):
+        if self.conn is None:
+            raise Unavailable('Not connected to the database')
 
-        except pymysql.Error as e:
-            self.print_func('Cannot open database' + e.args[1])
+        return self.conn
 
-        # Ensure relevant tables exist
+    def transient(self, e):
+        # Whether e says nothing about what was asked - the database is
+        # gone or busy - so asking again later may work
+        return (isinstance(e, (Unavailable, Contention))
+                or isinstance(e, self.backend.Error) and self.backend.transient(e))
+
+    def disconnect(self):
+        conn, self.conn = self.conn, None
+        if conn is not None:
+            try:
+                conn.close()
+            except self.backend.Error:
+                pass
+
+    def reconnect(self):
+        # Try for a new connection without reporting anything, for callers
+        # that retry on their own. Whether it worked.
         try:
-            self.create_tables()
-        except pymysql.Error as e:
-            self.print_func('Failed to create tables', e.args[1])
+            self.conn = self.backend.connect()
+        except self.backend.Error:
+            return False
 
-    def __del__(self):
-        self.conn.close()
+        self.check_schema()
+        return True
 
-    def remove(self, table, where):
-        remove_sql = f'''
-            DELETE FROM {table} WHERE {where}
-        '''
+    def rollback(self):
+        try:
+            self.conn.rollback()
+        except self.backend.Error:
+            # The connection went with the transaction
+            self.disconnect()
 
+    def remove(self, table, where):
+        return self.write([('remove', table, where)], 'Failed to delete items!')
+
+    def insert(self, table, columns, rows, *, ignore_duplicates=False):
+        # The number of rows inserted - with ignore_duplicates, rows that
+        # were already there are not counted - or None if the insert failed
+        rows = [tuple(row) for row in rows]
+        if not columns or not rows:
+            return 0
+
+        counts = {}
+        if not self.write([('insert', table, tuple(columns), rows)], 'Failed to add items!',
+                          ignore_duplicates=ignore_duplicates, counts=counts):
+            return None
+
+        return counts.get(table, 0)
+
+    def apply(self, changes, *, raise_errors=False):
+        # Run a batch of writes as one transaction - either every change is
+        # made or none are. Each change is ('insert', table, columns, rows),
+        # which skips rows that already exist in idempotent_inserts tables
+        # and fails on them elsewhere, ('upsert', table, columns, rows),
+        # which replaces them, or ('remove', table, where). With
+        # raise_errors a failure raises rather than being reported, for
+        # callers that decide whether to try again (see transient).
+        if not changes:
+            return True
+
+        return self.write(changes, 'Failed to save changes!', raise_errors=raise_errors)
+
+    def write(self, changes, error, *, ignore_duplicates=False, raise_errors=False, counts=None):
+        # counts, if given, is filled with table -> rows inserted
         success = False
 
+        if self.conn is None:
+            if raise_errors:
+                raise Unavailable('Not connected to the database')
+            self.print_func(error + 'Not connected to the database')
+            return False
+
         try:
+            self.conn.begin()
+
             with self.conn.cursor() as cur:
-                cur.execute(remove_sql)
+                for change in changes:
+                    if change[0] == 'insert':
+                        n = self.write_insert(cur, *change[1:],
+                                              ignore_duplicates or change[1] in idempotent_inserts)
+                        if counts is not None:
+                            counts[change[1]] = counts.get(change[1], 0) + n
+                    elif change[0] == 'upsert':
+                        self.write_upsert(cur, *change[1:])
+                    else:
+                        self.write_remove(cur, *change[1:])
 
             self.conn.commit()
             success = True
-        except pymysql.Error as e:
-            self.print_func('Failed to delete items!' + e.args[1])
+        except (self.backend.Error, Contention) as e:
+            self.rollback()
+            if isinstance(e, self.backend.Error) and self.backend.transient(e):
+                self.disconnect()
+            if raise_errors:
+                raise
+            self.print_func(error + backends.error_message(e))
+        except Exception:
+            self.rollback()
+            raise
+        finally:
+            for table in {change[1] for change in changes}:
+                self.written(table, success)
 
         return success
 
-    def insert(self, table, attrs, values, *, ignore_duplicates=False):
-        if attrs == '' or values == '':
-            return False
+    def write_insert(self, cur, table, columns, rows, ignore_duplicates):
+        if table == 'attendance':
+            present = [(row[columns.index('enrollment_id')], row[columns.index('date')])
+                       for row in rows]
+            return self.mark_attendance(cur, present, True)
+
+        insert_sql = compile_insert(table, tuple(columns),
+                                    self.backend.insert_ignore if ignore_duplicates else 'INSERT')
+
+        # pymysql folds executemany on an INSERT into multi-row
+        # statements, and sqlite3 runs it as one prepared statement
+        start = time.perf_counter()
+        cur.executemany(insert_sql, rows)
+
+        self.stats.record(insert_sql, time.perf_counter() - start, len(rows),
+                          diagnostics.size_of(rows))
+
+        # Both drivers add up the rows each statement inserted, so skipped
+        # duplicates are left out
+        return cur.rowcount
+
+    def write_upsert(self, cur, table, columns, rows):
+        # Rows whose primary key already exists have their other columns
+        # overwritten
+        keys = primary_keys[table]
+        upsert_sql = (compile_insert(table, tuple(columns), 'INSERT') + ' '
+                      + self.backend.on_conflict(keys, {c: '{new}' for c in columns if c not in keys}))
+
+        start = time.perf_counter()
+        cur.executemany(upsert_sql, rows)
+
+        self.stats.record(upsert_sql, time.perf_counter() - start, len(rows),
+                          diagnostics.size_of(rows))
+
+    def write_remove(self, cur, table, where):
+        shape, params = predicate_shape(where)
+
+        if table == 'attendance':
+            # Look up which days the predicate matches through the view,
+            # then clear their bits
+            select_sql = compile_select(table, ('enrollment_id', 'date'), shape,
+                                        False, None, False, False)
+            cur.execute(select_sql, params)
+            return self.mark_attendance(cur, cur.fetchall(), False)
+
+        remove_sql = compile_delete(table, shape)
+
+        start = time.perf_counter()
+        cur.execute(remove_sql, params)
+
+        self.stats.record(remove_sql, time.perf_counter() - start, cur.rowcount, 0,
+                          params=params,
+                          explain=lambda: self.explain(remove_sql, params))
+
+    def mark_attendance(self, cur, rows, present):
+        # Attendance is kept as one bitset per enrollment over its term's
+        # class days, in words of 63 days (see migrations). rows are
+        # (enrollment_id, date) - marking them present sets their bits,
+        # otherwise they are cleared. Both are a single atomic update per
+        # word, so concurrent marks never lose each other. Returns how many
+        # marks were not already set (or cleared).
+        rows = [(int(e), d) for e, d in rows]
+        if not rows:
+            return 0
+
+        start = time.perf_counter()
+
+        # Enrollments that no longer exist are skipped, the same as
+        # INSERT IGNORE would
+        shape, params = predicate_shape({'id': sorted({e for e, d in rows})})
+        cur.execute(compile_select('enrollment_data', ('id', 'term', 'course_id'), shape,
+                                   False, None, False, False), params)
+        enrollments = {e: (term, course_id) for e, term, course_id in cur.fetchall()}
+        terms = {e: term for e, (term, course_id) in enrollments.items()}
+
+        dates = {}
+        for e, d in rows:
+            if e in terms:
+                dates.setdefault(terms[e], set()).add(str(d))
+
+        days = {term: self.class_days(cur, term, term_dates, add=present)
+                for term, term_dates in dates.items()}
+
+        masks = {}
+        taught = set()
+        for e, d in rows:
+            day = days.get(terms.get(e), {}).get(str(d))
+            if day is not None:
+                day, word, mask = day
+                masks[e, word] = masks.get((e, word), 0) | mask
+                taught.add(enrollments[e] + (day,))
+
+        # The words as they were, only to count what changes
+        old = {}
+        if masks:
+            shape, params = predicate_shape({'enrollment_id': sorted({e for e, word in masks})})
+            cur.execute(compile_select('attendance_bits', ('enrollment_id', 'word', 'bits'), shape,
+                                       False, None, False, False), params)
+            old = {(e, word): bits for e, word, bits in cur.fetchall()}
+
+        changed = sum(bin((mask & ~old.get(key, 0)) if present else (mask & old.get(key, 0))).count('1')
+                      for key, mask in masks.items())
+
+        if present:
+            bits_sql = ('INSERT INTO attendance_bits (enrollment_id, word, bits) VALUES (%s, %s, %s) '
+                        + self.backend.on_conflict(('enrollment_id', 'word'), {'bits': 'bits | {new}'}))
+            cur.executemany(bits_sql, [(e, word, mask) for (e, word), mask in masks.items()])
+        else:
+            bits_sql = 'UPDATE attendance_bits SET bits = bits & ~%s WHERE enrollment_id = %s AND word = %s'
+            cur.executemany(bits_sql, [(mask, e, word) for (e, word), mask in masks.items()])
+
+        self.stats.record(bits_sql, time.perf_counter() - start, len(rows), 0)
+
+        self.update_attendance_summary(cur, sorted({e for e, word in masks}), sorted(taught))
+
+        return changed
+
+    def update_attendance_summary(self, cur, enrollment_ids, taught):
+        # Keep the report tables in step with the bits just changed: each
+        # enrollment touched has its days present counted again (a handful
+        # of words), and every (term, course_id, day) roll was taken on is
+        # recorded as a class day for the course
+        if enrollment_ids:
+            shape, params = predicate_shape({'enrollment_id': enrollment_ids})
+            summary_sql = ('INSERT INTO attendance_summary (enrollment_id, days_present) '
+                           'SELECT enrollment_id, SUM(BIT_COUNT(bits)) FROM attendance_bits'
+                           + compile_where(shape)
+                           + ' GROUP BY enrollment_id '
+                           + self.backend.on_conflict(('enrollment_id',), {'days_present': '{new}'}))
+            cur.execute(summary_sql, params)
+
+        if taught:
+            cur.executemany(compile_insert('course_calendar', ('term', 'course_id', 'day'),
+                                           self.backend.insert_ignore),
+                            taught)
+
+    def class_days(self, cur, term, dates, *, add):
+        # date -> (day, word, mask) for each of dates in the term's calendar.
+        # With add, dates not in it yet are given the next free days.
+        found = {}
+        for attempt in range(3):
+            # Once days have been added, look again with a locking read, so
+            # days another client committed in the meantime are seen too
+            lock = self.backend.locking_read if attempt else ''
+
+            shape, params = predicate_shape([('term', '=', term), ('date', 'IN', sorted(dates))])
+            cur.execute(compile_select('term_calendar', ('date', 'day', 'word', 'mask'), shape,
+                                       False, None, False, False) + lock, params)
+            found = {str(row[0]): row[1:] for row in cur.fetchall()}
+
+            missing = sorted(dates - set(found))
+            if not add or not missing:
+                return found
+
+            cur.execute('SELECT MAX(day) FROM term_calendar WHERE term = %s' + self.backend.locking_read,
+                        (term,))
+            last = cur.fetchone()[0]
+            first = last + 1 if last is not None else 0
+
+            # Another client may take the same days first, in which case
+            # these are skipped and looked up again
+            cur.executemany(compile_insert('term_calendar', ('term', 'day', 'date', 'word', 'mask'),
+                                           self.backend.insert_ignore),
+                            [(term, day, d, day // 63, 1 << (day % 63))
+                             for day, d in enumerate(missing, first)])
+
+        # Marks for dates that never got a day would be lost, so nothing is
+        # saved instead
+        raise Contention(f'Could not add {", ".join(missing)} to the {term} calendar')
+
+    def written(self, table, success):
+        self.cache.invalidate(table)
+
+        if success and self.on_write is not None:
+            self.on_write(affected_tables(table))
+
+    def get(self, table, columns, *, where=None, distinct=False, order_by=None, limit=None, offset=None):
+        shape, params = predicate_shape(where)
+
+        if isinstance(order_by, str):
+            order_by = (order_by,)
+
+        select_sql = compile_select(table,
+                                    tuple(columns),
+                                    shape,
+                                    distinct,
+                                    tuple(order_by) if order_by else None,
+                                    limit is not None,
+                                    limit is not None and offset is not None,
+                                    self.backend.prefix_collation)
+
+        if limit is not None:
+            params.append(int(limit))
+            if offset is not None:
+                params.append(int(offset))
+
+        return self.fetch(select_sql, params, [table], 'Failed to get items!')
+
+    def fetch(self, sql, params, tables, error, *, cached=True):
+        # Run a read through the cache. tables lists everything the query
+        # reads from, so writes to any of them drop the cached result.
+        start = time.perf_counter()
+
+        key = (sql, tuple(params))
+        items = self.cache.get(key) if cached else None
+        if items is not None:
+            self.stats.record(sql, time.perf_counter() - start, len(items), 0, cached=True)
+            return items
+
+        tables = self.cache.tables_for(tables)
+        snapshot = self.cache.snapshot(tables)
+
+        items = ()
 
-        insert_sql = f'''
-            INSERT INTO {table} ({attrs}) VALUES {values}
-        '''
+        try:
+            with self.connection().cursor() as cur:
+                cur.execute(sql, params)
+                items = cur.fetchall()
+        except self.backend.Error as e:
+            # A lost connection is dropped, to be opened again by whoever
+            # retries, rather than reported on every read
+            if self.backend.transient(e):
+                self.disconnect()
+                raise Unavailable(backends.error_message(e)) from e
 
-        success = False
+            self.print_func(error + backends.error_message(e))
+            return items
 
-        try:
-            with self.conn.cursor() as cur:
-                cur.execute(insert_sql)
+        self.stats.record(sql, time.perf_counter() - start, len(items),
+                          diagnostics.size_of(items),
+                          params=params,
+                          explain=lambda: self.explain(sql, params))
 
-            self.conn.commit()
-            success = True
-        except pymysql.Error as e:
-            if type(e) is pymysql.IntegrityError and ignore_duplicates:
-                success = True
+        if cached:
+            self.cache.put(key, tables, snapshot, items)
 
-            if not success:
-                self.print_func('Failed to add items!' + e.args[1])
+        return items
 
-        return success
+    def explain(self, sql, params):
+        with self.connection().cursor() as cur:
+            cur.execute(self.backend.explain + sql, params)
+            return cur.fetchall()
+
+    def iter_rows(self, table, columns, *, where=None, order_by=None, batch_size=1000):
+        # Stream rows with the backend's streaming cursor, so memory stays
+        # flat no matter how big the table is. The connection cannot be used for
+        # anything else until the generator is exhausted or closed.
+        shape, params = predicate_shape(where)
 
-    def get(self, table, attrs, *, where=None):
-        select_sql = f'''
-            SELECT {attrs} FROM {table}
-        '''
+        if isinstance(order_by, str):
+            order_by = (order_by,)
 
-        if where is not None:
-            select_sql += f'WHERE {where}'
+        select_sql = compile_select(table,
+                                    tuple(columns),
+                                    shape,
+                                    False,
+                                    tuple(order_by) if order_by else None,
+                                    False,
+                                    False,
+                                    self.backend.prefix_collation)
 
-        items = []
+        n = 0
+        size = 0
 
         try:
-            with self.conn.cursor() as cur:
-                cur.execute(select_sql)
-                items = cur.fetchall()
-        except pymysql.Error as e:
-            self.print_func('Failed to get items!' + e.args[1])
+            start = time.perf_counter()
+            with self.backend.streaming_cursor(self.connection()) as cur:
+                cur.execute(select_sql, params)
 
-        return items
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+
+                    n += len(rows)
+                    size += diagnostics.size_of(rows)
+                    yield from rows
+
+            # Includes time spent by whatever consumed the rows
+            self.stats.record(select_sql, time.perf_counter() - start, n, size, params=params)
+        except self.backend.Error as e:
+            self.print_func('Failed to get items!' + backends.error_message(e))
+
+    def get_columns(self, table):
+        columns = []
 
-    def create_tables(self):
-        create_student_table = '''
-            CREATE TABLE IF NOT EXISTS students (
-                id INT UNSIGNED AUTO_INCREMENT NOT NULL PRIMARY KEY,
-                name VARCHAR(30) NOT NULL,
-                CONSTRAINT UNIQUE (name)
-                )
+        try:
+            columns = self.backend.columns(self.connection(), identifier(table))
+        except self.backend.Error as e:
+            self.print_func('Failed to get columns!' + backends.error_message(e))
+
+        return columns
+
+    def count(self, table, *, where=None):
+        items = self.get(table, ['COUNT(*)'], where=where)
+
+        return items[0][0] if items else 0
+
+    def get_page(self, table, columns, *, after=None, order_by='id', descending=False, limit=200, where=None):
+        # Keyset pagination - pages are anchored on the key of the last row
+        # seen rather than an OFFSET, so fetching deep pages costs the same as
+        # the first. In id order the key is the id; sorted on another column
+        # it is (value, id), so rows with equal values still page in a fixed
+        # order and an index on the column (which includes the id) serves it.
+        where = predicates(where)
+        op, direction = ('<', ' DESC') if descending else ('>', '')
+
+        if order_by == 'id':
+            order = ['id' + direction]
+            if after is not None:
+                where.append(('id', op, after))
+        else:
+            order = [order_by + direction, 'id' + direction]
+            if after is not None:
+                where.append(((order_by, 'id'), op, tuple(after)))
+
+        return self.get(table, ['id'] + list(columns),
+                        where=where,
+                        order_by=order,
+                        limit=limit)
+
+    def get_page_key(self, table, offset, *, order_by='id', descending=False, where=None):
+        # Key of the row just before the given position, used to jump into
+        # the middle of a table without walking every page in between
+        if offset <= 0:
+            return None
+
+        direction = ' DESC' if descending else ''
+
+        if order_by == 'id':
+            items = self.get(table, ['id'], where=where, order_by='id' + direction,
+                             limit=1, offset=offset - 1)
+            return items[0][0] if items else None
+
+        items = self.get(table, [order_by, 'id'], where=where,
+                         order_by=[order_by + direction, 'id' + direction],
+                         limit=1, offset=offset - 1)
+
+        return tuple(items[0]) if items else None
+
+    def search(self, table, column, prefix, *, extra=(), limit=20):
+        # (id, column, *extra) for the first rows whose column starts with
+        # prefix, in order - an index range scan, however big the table
+        return self.get(table, ['id', column, *extra],
+                        where=[(column, 'PREFIX', prefix)],
+                        order_by=column,
+                        limit=limit)
+
+    def get_terms(self):
+        return self.get('terms', ['name'], order_by='name')
+
+    def get_term_courses(self, term):
+        # The term's offerings are a short range of the catalog's key, and
+        # only those courses are looked up for their names
+        courses_sql = '''
+            SELECT
+                c.course_name,
+                c.id
+            FROM
+                term_courses t
+            INNER JOIN
+                courses c
+            ON
+                t.course_id = c.id
+            WHERE
+                t.term = %s
+            ORDER BY
+                c.course_name
             '''
 
-        create_assignment_table = '''
-            CREATE TABLE IF NOT EXISTS assignments (
-                id INT UNSIGNED AUTO_INCREMENT NOT NULL PRIMARY KEY,
-                name VARCHAR(30) NOT NULL,
-                CONSTRAINT UNIQUE (name)
-                )
+        return self.fetch(courses_sql,
+                          (term,),
+                          ['term_courses', 'courses'],
+                          'Failed to get courses!')
+
+    def get_enrolled(self, term, course_id, *, sort=False, descending=False, prefix=''):
+        # Optionally sorted by name and narrowed to names starting with
+        # prefix - the course's handful of rows are found by the term and
+        # course index first, so the database does both cheaply
+        where = [('term', '=', term), ('c_id', '=', course_id)]
+        if prefix:
+            where.append(('s_name', 'PREFIX', prefix))
+
+        order_by = None
+        if sort:
+            order_by = ['s_name DESC', 'id DESC'] if descending else ['s_name', 'id']
+
+        return self.get('enrollment', ['id', 's_name'], where=where, order_by=order_by)
+
+    def get_course_grades(self, term, course_id):
+        # Every score recorded for the course in one pass, as
+        # (enrollment_id, assignment_id, score)
+        grades_sql = '''
+            SELECT
+                g.enrollment_id,
+                g.assignment_id,
+                g.score
+            FROM
+                grades g
+            INNER JOIN
+                enrollment_data e
+            ON
+                g.enrollment_id = e.id
+            WHERE
+                e.term = %s AND e.course_id = %s
             '''
 
-        create_course_table = '''
-            CREATE TABLE IF NOT EXISTS courses (
-                id INT UNSIGNED AUTO_INCREMENT NOT NULL PRIMARY KEY,
-                course_name VARCHAR(30) NOT NULL,
-                instructor_name VARCHAR(30) NOT NULL,
-                CONSTRAINT UNIQUE (course_name,instructor_name)
-                )
+        return self.fetch(grades_sql,
+                          (term, course_id),
+                          ['enrollment_data', 'grades'],
+                          'Failed to get grades!')
+
+    def get_roster(self, term, course_id, date):
+        # Every student enrolled in the course along with whether they were
+        # present on the date, in one pass - a single bit test per student
+        roster_sql = '''
+            SELECT
+                e.id,
+                s.name,
+                COALESCE(b.bits & c.mask, 0) <> 0
+            FROM
+                enrollment_data e
+            INNER JOIN
+                students s
+            ON
+                e.student_id = s.id
+            LEFT JOIN
+                term_calendar c
+            ON
+                c.term = e.term AND c.date = %s
+            LEFT JOIN
+                attendance_bits b
+            ON
+                b.enrollment_id = e.id AND b.word = c.word
+            WHERE
+                e.term = %s AND e.course_id = %s
             '''
 
-        create_enrollment_table = '''
-            CREATE TABLE IF NOT EXISTS enrollment_data (
-                id INT UNSIGNED AUTO_INCREMENT NOT NULL PRIMARY KEY,
-                student_id INT UNSIGNED NOT NULL REFERENCES student(id),
-                course_id INT UNSIGNED NOT NULL REFERENCES course(id),
-                term VARCHAR(30) NOT NULL,
-                CONSTRAINT UNIQUE (student_id, course_id, term)
-                )
+        return self.fetch(roster_sql,
+                          (date, term, course_id),
+                          ['enrollment_data', 'students', 'attendance'],
+                          'Failed to get roster!')
+
+    def get_attendance_rates(self, term, course_id):
+        # For every student enrolled in the course, the number of days they
+        # were present and the number of days the course has met so far
+        rates_sql = '''
+            SELECT
+                e.id,
+                s.name,
+                CAST(COALESCE(SUM(BIT_COUNT(b.bits)), 0) AS SIGNED),
+                (SELECT COUNT(*) FROM course_calendar c WHERE c.term = e.term AND c.course_id = e.course_id)
+            FROM
+                enrollment_data e
+            INNER JOIN
+                students s
+            ON
+                e.student_id = s.id
+            LEFT JOIN
+                attendance_bits b
+            ON
+                b.enrollment_id = e.id
+            WHERE
+                e.term = %s AND e.course_id = %s
+            GROUP BY
+                e.id, s.name, e.term, e.course_id
             '''
 
-        create_enrollment_view = '''
-            CREATE OR REPLACE VIEW
-                enrollment
-            AS SELECT
+        return self.fetch(rates_sql,
+                          (term, course_id),
+                          ['enrollment_data', 'students', 'attendance'],
+                          'Failed to get attendance!')
+
+    def get_at_risk(self, term, threshold=0.8):
+        # Every student in the term attending less than threshold of their
+        # course's class days, worst first. Reads only the summary tables,
+        # so it costs the same however much history there is.
+        at_risk_sql = '''
+            SELECT
                 e.id,
-                e.term,
-                e.course_id c_id,
-                c.course_name c_name,
-                e.student_id s_id,
-                s.name s_name
+                s.name,
+                c.course_name,
+                COALESCE(a.days_present, 0),
+                d.days
             FROM
                 enrollment_data e
             INNER JOIN
-                courses c
+                (SELECT course_id, COUNT(*) days FROM course_calendar WHERE term = %s GROUP BY course_id) d
             ON
-                e.course_id = c.id
+                d.course_id = e.course_id
             INNER JOIN
                 students s
             ON
                 e.student_id = s.id
+            INNER JOIN
+                courses c
+            ON
+                e.course_id = c.id
+            LEFT JOIN
+                attendance_summary a
+            ON
+                a.enrollment_id = e.id
+            WHERE
+                e.term = %s AND COALESCE(a.days_present, 0) < %s * d.days
+            ORDER BY
+                COALESCE(a.days_present, 0) * 1.0 / d.days, s.name, c.course_name
             '''
 
-        create_attendance_table = '''
-            CREATE TABLE IF NOT EXISTS attendance (
-                enrollment_id INT UNSIGNED NOT NULL REFERENCES enrollment(id),
-                date DATE NOT NULL,
-                CONSTRAINT UNIQUE (enrollment_id, date)
-                )
+        return self.fetch(at_risk_sql,
+                          (term, term, threshold),
+                          ['enrollment_data', 'students', 'courses', 'attendance'],
+                          'Failed to get report!')
+
+    def get_changes(self, after, limit=1000):
+        # Rows changed by any client since changelog entry after, oldest
+        # first, as (id, table, row_id, op). Never cached, since the point
+        # is to see writes this process did not make.
+        changes_sql = '''
+            SELECT id, table_name, row_id, op FROM changelog
+            WHERE id > %s
+            ORDER BY id
+            LIMIT %s
             '''
 
-        create_grade_table = '''
-            CREATE TABLE IF NOT EXISTS grades (
-                assignment_id INT UNSIGNED NOT NULL REFERENCES assignment(id),
-                enrollment_id INT UNSIGNED NOT NULL REFERENCES enrollment(id),
-                score INT
-            )
-        '''
-
-        with self.conn.cursor() as cursor:
-            warnings.filterwarnings('ignore')
-            cursor.execute(create_student_table)
-            cursor.execute(create_assignment_table)
-            cursor.execute(create_course_table)
-            cursor.execute(create_enrollment_table)
-            cursor.execute(create_enrollment_view)
-            cursor.execute(create_attendance_table)
-            cursor.execute(create_grade_table)
-            warnings.filterwarnings('default')
-
-        self.conn.commit()
-
-    def insert_test_data(self):
-        students = [
-            ('Fariha Quinn'),
-            ('Giovanni Hagan'),
-            ('Lyla-Rose Wyatt'),
-            ('Nolan Knights'),
-            ('Aarush Mullen'),
-            ('Akeel Mccarty'),
-            ('Riaan Mason'),
-            ('Cain Nichols'),
-            ('Caitlyn Horn'),
-            ('Luc Park')
-        ]
-
-        insert_students = f'''
-            INSERT INTO students (name) VALUES {','.join(f'("{s}")' for s in students)}
-        '''
-
-        courses = [
-            ('Acacia Bob', 'Alien Bioengineering'),
-            ('Shyla Molloy', 'Planetary Biology'),
-            ('Lorena Archer', 'Life Gardening'),
-            ('Carys Joyce', 'Foreign Drama'),
-            ('Gurveer Hicks', 'Alien Mathematics'),
-            ('Susie Adams', 'Alien Ethics'),
-            ('Henry Mcnamara', 'Extinct Language Literature'),
-            ('Henrietta Person', 'Alien Biology'),
-            ('Krista Miranda', 'Alien Tactics and Strategy'),
-            ('Tasnia Avery', 'Ward Casting')
-        ]
-
-        insert_courses = f'''
-            INSERT INTO courses
-                (instructor_name, course_name)
-            VALUES
-                {','.join(f'{s}' for s in courses)}
-        '''
-
-        insert_assignments = f'''
-            INSERT INTO assignments
-                (name)
-            VALUES
-                {','.join(f'("Homework {i+1}")' for i in range(10))}
-        '''
-
-        with self.conn.cursor() as cur:
-            try:
-                cur.execute(insert_students)
-            except:
-                pass
+        return self.fetch(changes_sql, (after, limit), ['changelog'],
+                          'Failed to get changes!', cached=False)
 
-            try:
-                cur.execute(insert_courses)
-            except:
-                pass
+    def last_change(self):
+        items = self.fetch('SELECT MAX(id) FROM changelog', (), ['changelog'],
+                           'Failed to get changes!', cached=False)
 
-            try:
-                cur.execute(insert_assignments)
-            except:
-                pass
+        return (items[0][0] or 0) if items else 0
 
-        self.conn.commit()
+    def prune_changes(self, keep):
+        # Drop all but the newest keep entries - see changefeed for why
+        # that is safe
+        newest = self.last_change()
+        if newest > keep:
+            self.remove('changelog', [('id', '<=', newest - keep)])
 
-        student_ids = []
-        course_ids = []
-        with self.conn.cursor() as cur:
-            try:
-                cur.execute('SELECT id FROM students')
-                student_ids = [id[0] for id in cur.fetchall()]
-            except:
-                pass
+    def migrate(self):
+        migrations.upgrade(self.conn, self.backend)
+        self.cache.clear()
 
-            try:
-                cur.execute('SELECT id FROM courses')
-                course_ids = [id[0] for id in cur.fetchall()]
-            except:
-                pass
+    def check_schema(self):
+        # Bring the schema up to date - when it already is, this is a
+        # single query
+        if self.conn is None:
+            return
 
-        terms = [
-            ('Spring 2020'),
-            ('Fall 2019'),
-            ('Spring 2019'),
-            ('Fall 2018'),
-            ('Spring 2018'),
-            ('Fall 2017')
-        ]
-
-        values = []
-        for term in terms:
-            n = random.randint(0, len(course_ids))
-            c_ids = random.sample(course_ids, n)
-            for c_id in c_ids:
-                m = random.randint(0, len(student_ids))
-                s_ids = random.sample(student_ids, m)
-                for s_id in s_ids:
-                    values.append((term,c_id,s_id))
-
-        with self.conn.cursor() as cur:
-            insert_enrollment = '''
-                INSERT INTO enrollment_data
-                    (term, course_id, student_id)
-                VALUES
-                    (%s, %s, %s)
-            '''
-
-            try:
-                cur.executemany(insert_enrollment, values)
-            except:
-                pass
-
-        self.conn.commit()
+        try:
+            self.migrate()
+        except self.backend.Error as e:
+            self.print_func('Failed to update database schema' + backends.error_message(e))
+
+    def insert_test_data(self, sizes='small', *, seed=557, progress=None):
+        # See datagen for the presets - 'small' is a handful of students and
+        # courses, the larger ones are for load testing
+        return datagen.generate(self, sizes, seed=seed, progress=progress)
 
 if __name__ == '__main__':
     # This module is not callable
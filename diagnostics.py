@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+from collections import deque
+import logging
+import os
+import sys
+import threading
+import time
+
+__author__ = 'Colin Leary'
+
+log = logging.getLogger('sie557.queries')
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+def caller(skip=('db.py', 'diagnostics.py', 'executor.py', 'datagen.py')):
+    # The first frame outside the data layer - for queries made from a frame
+    # this names the method that asked for them
+    f = sys._getframe(1)
+    while f is not None and os.path.basename(f.f_code.co_filename) in skip:
+        f = f.f_back
+
+    if f is None:
+        return '?'
+
+    name = getattr(f.f_code, 'co_qualname', f.f_code.co_name)
+    name = name.replace('.<locals>.<lambda>', '')
+
+    return f'{os.path.basename(f.f_code.co_filename)}:{f.f_lineno} {name}'
+
+def size_of(rows):
+    # Rough size of a result - what the values would take as text
+    n = 0
+    for row in rows:
+        for v in row:
+            n += len(v) if isinstance(v, (str, bytes)) else 8
+
+    return n
+
+# Milestones since the process started, for seeing where startup time goes.
+# Only the first time each is reached counts, since every worker thread
+# passes the same ones.
+class Timeline:
+    def __init__(self, start=None):
+        self.start = time.perf_counter() if start is None else start
+        self.marks = {}
+        self.lock = threading.Lock()
+
+    def mark(self, name):
+        with self.lock:
+            self.marks.setdefault(name, time.perf_counter() - self.start)
+
+    def report(self):
+        lines = []
+        last = 0
+        for name, t in sorted(self.marks.items(), key=lambda m: m[1]):
+            lines.append(f'{name:12} {t * 1000:8.1f}ms  (+{(t - last) * 1000:.1f}ms)')
+            last = t
+
+        return '\n'.join(lines)
+
+class Shape:
+    def __init__(self, sql):
+        self.sql = sql
+        self.count = 0
+        self.cache_hits = 0
+        self.rows = 0
+        self.bytes = 0
+        self.callers = set()
+        self.times = deque(maxlen=500)
+
+# Counts and timings for every statement the Database runs, grouped by the
+# statement text (which has the values parameterized out, so it is the shape
+# of the query). Statements slower than slow_ms are logged with their caller
+# and, if explain is set, the plan MySQL chose for them.
+#
+# One QueryStats can be shared by every connection in the app.
+class QueryStats:
+    def __init__(self, *, slow_ms=200, explain=False, keep_slow=100):
+        self.slow_ms = slow_ms
+        self.explain = explain
+
+        self.shapes = {}
+        self.slow = deque(maxlen=keep_slow)
+        self.lock = threading.Lock()
+
+    def record(self, sql, seconds, rows, size, *, cached=False, params=None, explain=None):
+        where = caller()
+        ms = seconds * 1000
+        sql = ' '.join(sql.split())
+
+        with self.lock:
+            shape = self.shapes.get(sql)
+            if shape is None:
+                shape = self.shapes[sql] = Shape(sql)
+
+            shape.count += 1
+            shape.cache_hits += cached
+            shape.rows += rows
+            shape.bytes += size
+            shape.callers.add(where)
+            shape.times.append(ms)
+
+        if cached or ms < self.slow_ms:
+            return
+
+        plan = None
+        if self.explain and explain is not None:
+            try:
+                plan = explain()
+            except Exception as e:
+                plan = f'EXPLAIN failed: {e}'
+
+        with self.lock:
+            self.slow.append((time.strftime('%H:%M:%S'), ms, rows, where, sql, plan))
+
+        log.warning('Slow query (%.1fms, %d rows) from %s: %s %r%s',
+                    ms, rows, where, sql, params,
+                    f'\n    plan: {plan}' if plan is not None else '')
+
+    def summary(self):
+        # One row per shape, slowest first
+        with self.lock:
+            rows = [(s.sql,
+                     ', '.join(sorted(s.callers)),
+                     s.count,
+                     s.cache_hits,
+                     percentile(s.times, 50),
+                     percentile(s.times, 95),
+                     s.rows,
+                     s.bytes)
+                    for s in self.shapes.values()]
+
+        return sorted(rows, key=lambda r: r[5], reverse=True)
+
+    def slow_queries(self):
+        with self.lock:
+            return list(self.slow)
+
+    def reset(self):
+        with self.lock:
+            self.shapes.clear()
+            self.slow.clear()
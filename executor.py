@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+
+import queue
+import threading
+import time
+
+import db
+
+__author__ = 'Colin Leary'
+
+class Job:
+    def __init__(self, key, generation, func, callback, on_error=None):
+        self.key = key
+        self.generation = generation
+        self.func = func
+        self.callback = callback
+        self.on_error = on_error
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+# Runs database work off the Tk thread.
+#
+# Each worker thread opens its own connection, so a slow query never holds up
+# the main loop. Finished results are handed back through a queue which the Tk
+# thread drains with after(), so callbacks always run on the Tk thread.
+#
+# Jobs can be given a key - submitting a new job with the same key makes any
+# earlier one stale. Stale jobs are skipped if they have not started yet and
+# their results are thrown away if they have.
+#
+# A worker whose connection is lost (or never opened) opens a new one before
+# a later job, backing off up to max_delay seconds between tries. Jobs that
+# come up in between fail straight away with db.Unavailable, which is
+# reported once per outage, and handed to the job's on_error if it has one.
+class QueryExecutor:
+    def __init__(self, master, connect, *, report=print, workers=2, poll_ms=25, max_delay=30):
+        # connect(print_func) -> a Database for use by one worker thread
+        self.master = master
+        self.connect = connect
+        self.report = report
+        self.poll_ms = poll_ms
+        self.max_delay = max_delay
+
+        # Shared by the workers, so once one of them gets through the others
+        # try again at once. down is only used on the Tk thread.
+        self.delay = 1
+        self.retry_at = 0
+        self.down = False
+
+        self.jobs = queue.Queue()
+        self.results = queue.Queue()
+        self.generations = {}
+        self.lock = threading.Lock()
+        self.running = True
+
+        self.threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self.work, daemon=True)
+            t.start()
+            self.threads.append(t)
+
+        self.master.after(self.poll_ms, self.poll)
+
+    def submit(self, func, callback=None, *, key=None, on_error=None):
+        # func(db) runs on a worker, callback(result) runs on the Tk thread,
+        # or on_error(error) if the database could not be reached
+        with self.lock:
+            generation = self.generations.get(key, 0) + 1
+            if key is not None:
+                self.generations[key] = generation
+
+        job = Job(key, generation, func, callback, on_error)
+        self.jobs.put(job)
+
+        return job
+
+    def cancel(self, key):
+        # Make whatever is outstanding under key stale
+        with self.lock:
+            self.generations[key] = self.generations.get(key, 0) + 1
+
+    def call_soon(self, func, *args):
+        # Run something on the Tk thread from a worker
+        self.results.put((lambda: func(*args), None))
+
+    def is_stale(self, job):
+        if job.cancelled:
+            return True
+
+        if job.key is None:
+            return False
+
+        with self.lock:
+            return self.generations.get(job.key) != job.generation
+
+    def work(self):
+        db = self.connect(lambda message: self.call_soon(self.report, message))
+        if db.conn is None:
+            # connect has already said why
+            self.back_off()
+            self.call_soon(self.lost)
+
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+
+            if self.is_stale(job):
+                continue
+
+            if db.conn is None and time.monotonic() >= self.retry_at:
+                if db.reconnect():
+                    with self.lock:
+                        self.delay = 1
+                        self.retry_at = 0
+                    self.call_soon(self.reconnected)
+                else:
+                    self.back_off()
+
+            try:
+                result = job.func(db)
+            except db.Unavailable as e:
+                # The connection is gone (or was never there), and is tried
+                # again a little later
+                if self.retry_at <= time.monotonic():
+                    self.back_off()
+                self.call_soon(self.unavailable, job, e)
+                continue
+            except Exception as e:
+                self.call_soon(self.report, f'Background query failed! {e}')
+                continue
+
+            self.results.put((job, result))
+
+    def poll(self):
+        while True:
+            try:
+                job, result = self.results.get_nowait()
+            except queue.Empty:
+                break
+
+            if callable(job):
+                job()
+            elif job.callback is not None and not self.is_stale(job):
+                job.callback(result)
+
+        if self.running:
+            self.master.after(self.poll_ms, self.poll)
+
+    def back_off(self):
+        with self.lock:
+            self.retry_at = time.monotonic() + self.delay
+            self.delay = min(self.delay * 2, self.max_delay)
+
+    def lost(self):
+        self.down = True
+
+    def reconnected(self):
+        self.down = False
+
+    def unavailable(self, job, error):
+        if not self.down:
+            self.down = True
+            self.report(f'Lost the connection to the database, trying again in the background. {error}')
+
+        if job.on_error is not None and not self.is_stale(job):
+            job.on_error(error)
+
+    def shutdown(self, *, wait=0):
+        # Jobs already queued still run. wait is how many seconds to give
+        # them before returning.
+        self.running = False
+        for t in self.threads:
+            self.jobs.put(None)
+
+        for t in self.threads:
+            t.join(wait)
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import csv
+import json
+import os
+
+__author__ = 'Colin Leary'
+
+# Tables and views that can be exported
+exports = ['students', 'courses', 'assignments', 'enrollment', 'attendance', 'grades']
+
+formats = {
+    '.csv': 'csv',
+    '.jsonl': 'jsonl',
+    '.json': 'jsonl',
+}
+
+def format_for(path):
+    return formats.get(os.path.splitext(path)[1].lower(), 'csv')
+
+def export_table(db, table, path, *, fmt=None, columns=None, where=None, progress=None):
+    # Rows are streamed straight from the server to the file, so memory use
+    # does not depend on the size of the table
+    if fmt is None:
+        fmt = format_for(path)
+
+    if columns is None:
+        columns = db.get_columns(table)
+
+    if not columns:
+        raise ValueError(f'Nothing to export from {table}')
+
+    n = 0
+
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            write = writer.writerow
+        elif fmt == 'jsonl':
+            write = lambda row: f.write(json.dumps(dict(zip(columns, row)), default=str) + '\n')
+        else:
+            raise ValueError(f'Unknown export format: {fmt}')
+
+        for row in db.iter_rows(table, columns, where=where):
+            write(row)
+            n += 1
+
+            if progress is not None and n % 10000 == 0:
+                progress(n)
+
+    return n
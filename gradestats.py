@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+import warnings
+
+import numpy as np
+
+__author__ = 'Colin Leary'
+
+# Statistics for a course's grades, computed with NumPy.
+#
+# Everything works from the one (enrollment_id, assignment_id, score) result
+# Database.get_course_grades returns. It is turned into a students by
+# assignments matrix, with NaN where there is no score, and every statistic
+# is a single vectorized pass over that matrix - so a course with thousands
+# of students costs about the same as one with ten.
+#
+# NumPy is only needed here, and the app only imports this module when it
+# has grades to summarize.
+
+percentiles = (25, 50, 75, 90)
+bins = 10
+
+class CourseStats:
+    def __init__(self, enrollment_ids, assignment_ids, scores):
+        self.enrollment_ids = enrollment_ids
+        self.assignment_ids = assignment_ids
+        self.scores = scores
+
+        # Per assignment, over the students with a score for it
+        self.counts = np.count_nonzero(~np.isnan(scores), axis=0)
+        self.means = nan_reduce(np.nanmean, scores)
+        self.medians = nan_reduce(np.nanmedian, scores)
+        self.percentiles = nan_reduce(np.nanpercentile, scores, percentiles)
+        self.histograms = histograms(scores)
+
+        # Per student
+        self.totals = np.nansum(scores, axis=1)
+        self.student_means = nan_reduce(np.nanmean, scores, axis=1)
+
+        # Over the students' totals
+        self.total_mean = float(self.totals.mean()) if len(self.totals) else float('nan')
+        self.total_median = float(np.median(self.totals)) if len(self.totals) else float('nan')
+        self.total_percentiles = (np.percentile(self.totals, percentiles) if len(self.totals)
+                                  else np.full(len(percentiles), np.nan))
+        self.total_histogram = np.histogram(self.totals, bins=bins)
+
+    def assignment_rows(self):
+        # (assignment_id, count, mean, median, percentiles, histogram)
+        for i, a_id in enumerate(self.assignment_ids):
+            yield (int(a_id),
+                   int(self.counts[i]),
+                   float(self.means[i]),
+                   float(self.medians[i]),
+                   [float(p) for p in self.percentiles[:, i]],
+                   [int(n) for n in self.histograms[i]])
+
+    def student_totals(self):
+        # enrollment_id -> (total, mean)
+        return {int(e_id): (float(self.totals[i]), float(self.student_means[i]))
+                for i, e_id in enumerate(self.enrollment_ids)}
+
+def nan_reduce(func, scores, *args, axis=0):
+    # nanmean and friends warn about columns with no scores at all, and
+    # NaN is already the right answer for those
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return func(scores, *args, axis=axis)
+
+def histograms(scores, low=0, high=100):
+    # One histogram per assignment, all in one bincount - each score's bin
+    # is offset by its column, so every column gets its own run of bins
+    n_assignments = scores.shape[1]
+    rows, cols = np.nonzero(~np.isnan(scores))
+    values = scores[rows, cols]
+
+    index = np.clip(((values - low) * bins // (high - low)).astype(int), 0, bins - 1)
+    counts = np.bincount(cols * bins + index, minlength=n_assignments * bins)
+
+    return counts.reshape(n_assignments, bins)
+
+def course_stats(grades):
+    # grades are (enrollment_id, assignment_id, score) rows, in any order
+    data = np.array(grades, dtype=float).reshape(-1, 3)
+
+    enrollment_ids, rows = np.unique(data[:, 0].astype(np.int64), return_inverse=True)
+    assignment_ids, cols = np.unique(data[:, 1].astype(np.int64), return_inverse=True)
+
+    scores = np.full((len(enrollment_ids), len(assignment_ids)), np.nan)
+    scores[rows, cols] = data[:, 2]
+
+    return CourseStats(enrollment_ids, assignment_ids, scores)
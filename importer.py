@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+import csv
+import datetime
+import io
+import os
+
+__author__ = 'Colin Leary'
+
+# What each kind of CSV file holds. Entity files map straight onto their
+# table, enrollment files name the student and course, which are resolved to
+# ids before inserting. Attendance files name the enrollment the same way,
+# plus the date and an optional present column (yes unless it says no).
+imports = {
+    'students': {
+        'table': 'students',
+        'columns': ['name'],
+    },
+    'courses': {
+        'table': 'courses',
+        'columns': ['course_name', 'instructor_name'],
+    },
+    'assignments': {
+        'table': 'assignments',
+        'columns': ['name'],
+    },
+    'enrollments': {
+        'table': 'enrollment_data',
+        'columns': ['term', 'student', 'course'],
+    },
+    'attendance': {
+        'table': 'attendance',
+        'columns': ['term', 'student', 'course', 'date'],
+    },
+}
+
+absent_values = {'0', 'n', 'no', 'false', 'absent'}
+
+class ImportCancelled(Exception):
+    pass
+
+class ImportResult:
+    def __init__(self):
+        self.read = 0
+        self.written = 0
+        self.skipped = 0
+        self.duplicates = 0
+        self.failed_chunks = 0
+
+    def __str__(self):
+        s = f'Read {self.read} rows, wrote {self.written}'
+        if self.duplicates:
+            s += f', skipped {self.duplicates} already in the database'
+        if self.skipped:
+            s += f', skipped {self.skipped} with unknown students, courses or dates'
+        if self.failed_chunks:
+            s += f', {self.failed_chunks} chunks failed'
+
+        return s
+
+class Lookup:
+    # Name -> id maps built with one query each, so resolving an enrollment
+    # never goes back to the database
+    def __init__(self, db):
+        self.students = {name: id for id, name in db.get('students', ['id', 'name'])}
+
+        self.courses = {}
+        self.course_names = {}
+        for id, name, instructor in db.get('courses', ['id', 'course_name', 'instructor_name']):
+            self.courses[(name, instructor)] = id
+
+            # A course name on its own only resolves if just one instructor
+            # teaches it
+            self.course_names[name] = None if name in self.course_names else id
+
+    def course(self, name, instructor=None):
+        if instructor:
+            return self.courses.get((name, instructor))
+
+        return self.course_names.get(name)
+
+def read_chunks(path, chunk_size, progress=None):
+    # Stream the file a chunk of rows at a time, reporting progress as the
+    # fraction of the file read so far
+    size = os.path.getsize(path) or 1
+
+    with open(path, 'rb') as raw:
+        reader = csv.DictReader(io.TextIOWrapper(raw, encoding='utf-8-sig', newline=''))
+        reader.fieldnames = [f.strip().lower() for f in reader.fieldnames or []]
+
+        chunk = []
+        try:
+            for row in reader:
+                chunk.append(row)
+
+                if len(chunk) >= chunk_size:
+                    yield reader.fieldnames, chunk
+                    chunk = []
+
+                    if progress is not None:
+                        progress(raw.tell() / size)
+        except csv.Error as e:
+            raise ValueError(f'{os.path.basename(path)} line {reader.line_num}: {e}')
+
+        if chunk:
+            yield reader.fieldnames, chunk
+
+    if progress is not None:
+        progress(1.0)
+
+def import_csv(db, kind, path, *, chunk_size=5000, progress=None, cancelled=None):
+    spec = imports[kind]
+    result = ImportResult()
+
+    lookup = Lookup(db) if kind in ('enrollments', 'attendance') else None
+
+    for fields, chunk in read_chunks(path, chunk_size, progress):
+        missing = [c for c in spec['columns'] if c not in fields]
+        if missing:
+            raise ValueError(f'{os.path.basename(path)} is missing columns: {", ".join(missing)}')
+
+        if cancelled is not None and cancelled():
+            raise ImportCancelled(str(result))
+
+        result.read += len(chunk)
+
+        if kind == 'attendance':
+            changes, n = attendance_changes(db, lookup, chunk, result)
+            if db.apply(changes):
+                result.written += n
+            else:
+                result.failed_chunks += 1
+            continue
+
+        if lookup is None:
+            columns = spec['columns']
+            rows = [tuple((row[c] or '').strip() for c in columns) for row in chunk]
+        else:
+            columns = ['term', 'student_id', 'course_id']
+            rows = []
+            for row in chunk:
+                student_id = lookup.students.get((row['student'] or '').strip())
+                course_id = lookup.course((row['course'] or '').strip(),
+                                          (row.get('instructor') or '').strip())
+
+                if student_id is None or course_id is None:
+                    result.skipped += 1
+                    continue
+
+                rows.append(((row['term'] or '').strip(), student_id, course_id))
+
+        # Each chunk is its own batch and its own commit, and rows that are
+        # already present are skipped rather than failing the chunk
+        n = db.insert(spec['table'], columns, rows, ignore_duplicates=True)
+        if n is None:
+            result.failed_chunks += 1
+        else:
+            result.written += n
+            result.duplicates += len(rows) - n
+
+    return result
+
+def attendance_changes(db, lookup, chunk, result):
+    # A chunk of attendance marks as changes for Database.apply - days
+    # marked present are set and days marked absent cleared, so a file can
+    # also correct earlier marks
+    marks = []
+    for row in chunk:
+        student_id = lookup.students.get((row['student'] or '').strip())
+        course_id = lookup.course((row['course'] or '').strip(),
+                                  (row.get('instructor') or '').strip())
+        try:
+            date = datetime.date.fromisoformat((row['date'] or '').strip())
+        except ValueError:
+            date = None
+
+        if student_id is None or course_id is None or date is None:
+            result.skipped += 1
+            continue
+
+        present = (row.get('present') or '').strip().lower() not in absent_values
+        marks.append(((row['term'] or '').strip(), course_id, student_id, date, present))
+
+    if not marks:
+        return [], 0
+
+    # Every enrollment the chunk names, in one query
+    enrollments = {}
+    for e_id, term, c_id, s_id in db.get('enrollment_data',
+                                         ['id', 'term', 'course_id', 'student_id'],
+                                         where={'term': sorted({m[0] for m in marks}),
+                                                'course_id': sorted({m[1] for m in marks})}):
+        enrollments[(term, c_id, s_id)] = e_id
+
+    present = []
+    absent = {}
+    for term, course_id, student_id, date, is_present in marks:
+        e_id = enrollments.get((term, course_id, student_id))
+        if e_id is None:
+            result.skipped += 1
+        elif is_present:
+            present.append((e_id, date))
+        else:
+            absent.setdefault(date, []).append(e_id)
+
+    changes = [('insert', 'attendance', ('enrollment_id', 'date'), present)] if present else []
+    changes += [('remove', 'attendance', {'date': date, 'enrollment_id': e_ids})
+                for date, e_ids in absent.items()]
+
+    return changes, len(present) + sum(len(e_ids) for e_ids in absent.values())
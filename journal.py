@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+import datetime
+import json
+import sqlite3
+import threading
+
+import backends
+
+__author__ = 'Colin Leary'
+
+# Write-behind journal, so saving an edit never waits on the server.
+#
+# Batches of changes (as taken by Database.apply) are appended to a local
+# SQLite file and the edit counts as saved once that commits. A Replayer
+# thread then applies them to the real database oldest first, a few batches
+# to a transaction, and deletes them from the journal once they are in.
+# Replaying is idempotent for nearly everything - enrollments and marks that
+# already exist are skipped, upserts replace them and removes land the same
+# however often they run - so a batch that is applied but not yet deleted
+# when the app stops is simply applied again next time. The exception is an
+# added student, course or assignment, which would then be set aside as a
+# duplicate of itself, the row being there all the same.
+#
+# Anything still in the journal when the app closes is replayed the next
+# time it starts. Each workstation has its own journal file, and only one
+# copy of the app should use it at a time.
+
+def encode(value):
+    if isinstance(value, datetime.date):
+        return {'$date': value.isoformat()}
+
+    raise TypeError(f'Cannot journal {type(value).__name__}')
+
+def decode(obj):
+    if set(obj) == {'$date'}:
+        return datetime.date.fromisoformat(obj['$date'])
+
+    return obj
+
+def load_changes(text):
+    changes = []
+    for change in json.loads(text, object_hook=decode):
+        if change[0] == 'remove':
+            changes.append(tuple(change))
+        else:
+            kind, table, columns, rows = change
+            changes.append((kind, table, tuple(columns), [tuple(row) for row in rows]))
+
+    return changes
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+
+        # Each append is durable once it returns
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=FULL')
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS journal (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                changes TEXT NOT NULL,
+                failed TEXT
+                )
+            ''')
+        self.conn.commit()
+
+    def append(self, changes):
+        with self.lock, self.conn:
+            cur = self.conn.execute('INSERT INTO journal (changes) VALUES (?)',
+                                    (json.dumps(changes, default=encode),))
+            return cur.lastrowid
+
+    def pending(self, limit):
+        # The oldest batches still to be replayed, as (id, changes)
+        with self.lock:
+            rows = self.conn.execute('SELECT id, changes FROM journal WHERE failed IS NULL ORDER BY id LIMIT ?',
+                                     (limit,)).fetchall()
+
+        return [(id, load_changes(changes)) for id, changes in rows]
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM journal WHERE failed IS NULL').fetchone()[0]
+
+    def done(self, ids):
+        with self.lock, self.conn:
+            self.conn.executemany('DELETE FROM journal WHERE id = ?', [(id,) for id in ids])
+
+    def failed(self, id, message):
+        # Kept, but never replayed, so a bad batch does not hold up the rest
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE journal SET failed = ? WHERE id = ?', (message, id))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# Replays the journal on its own thread. connect(print_func) opens the
+# Database to replay into. notify(func, *args) must run func on the Tk
+# thread; it is used to call
+#
+#   on_replayed(ids, error) - the batches with these ids are in the
+#       database, or if error is given, never can be
+#   on_status(pending, error) - how many batches are waiting, and why, if
+#       the database cannot be reached
+#
+# When the database cannot be reached (or is busy - see Database.transient)
+# the replayer waits and tries again, backing off up to max_delay seconds.
+# Any other error is down to the batch itself, which is set aside so the rest
+# can go on.
+class Replayer:
+    def __init__(self, journal, connect, notify, *, on_replayed=None, on_status=None,
+                 batch_size=50, max_delay=30):
+        self.journal = journal
+        self.connect = connect
+        self.notify = notify
+        self.on_replayed = on_replayed
+        self.on_status = on_status
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def wake(self):
+        # Something new was appended
+        self.wakeup.set()
+
+    def stop(self, *, wait=0):
+        # Replay what is left, unless the database cannot be reached. wait
+        # is how many seconds to give it - anything not replayed by then is
+        # replayed next time.
+        self.stopping.set()
+        self.wakeup.set()
+        self.thread.join(wait)
+
+    def run(self):
+        db = None
+        messages = []
+        delay = 1
+
+        # After a batch fails, go one at a time up to the last of its
+        # entries, so the bad one is found and set aside alone
+        suspect = None
+
+        while True:
+            entries = self.journal.pending(1 if suspect is not None else self.batch_size)
+
+            if not entries:
+                self.status(None)
+                if self.stopping.is_set():
+                    break
+
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+
+            if db is None:
+                messages.clear()
+                db = self.connect(messages.append)
+                if db.conn is None:
+                    db = None
+                    self.status(messages[-1] if messages else 'Cannot open database')
+                    if self.stopping.wait(delay):
+                        break
+                    delay = min(delay * 2, self.max_delay)
+                    continue
+
+            ids = [id for id, changes in entries]
+            changes = [change for id, batch in entries for change in batch]
+
+            try:
+                db.apply(changes, raise_errors=True)
+            except Exception as e:
+                if db.transient(e):
+                    # Lost the connection, or the database is busy - all of
+                    # it is tried again
+                    db = None
+                    self.status(backends.error_message(e))
+                    if self.stopping.wait(delay):
+                        break
+                    delay = min(delay * 2, self.max_delay)
+                    continue
+
+                if len(entries) > 1:
+                    suspect = ids[-1]
+                    continue
+
+                self.journal.failed(ids[0], backends.error_message(e))
+                self.replayed(ids, backends.error_message(e))
+            else:
+                self.journal.done(ids)
+                self.replayed(ids, None)
+                delay = 1
+
+            self.status(None)
+
+            if suspect is not None and ids[-1] >= suspect:
+                suspect = None
+
+    def replayed(self, ids, error):
+        if self.on_replayed is not None:
+            self.notify(self.on_replayed, ids, error)
+
+    def status(self, error):
+        if self.on_status is not None:
+            self.notify(self.on_status, self.journal.count(), error)
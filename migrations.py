@@ -0,0 +1,702 @@
+#!/usr/bin/env python3
+
+import warnings
+
+import backends
+
+__author__ = 'Colin Leary'
+
+# Schema changes, in order, for each backend. Each step is a version number,
+# a description and a list of statements - either SQL, or a function taking a
+# cursor for steps that need to look before they leap.
+#
+# Once a migration has shipped it must never be edited. Changes to the schema
+# go in a new step at the end of the list.
+
+def fill_term_calendar(cursor, source='attendance', verb='INSERT'):
+    # Number each term's class days in date order, from 0. The numbering
+    # only depends on source, so with an ignoring verb a rerun adds just the
+    # days an interrupted run did not.
+    cursor.execute(f'''
+        SELECT DISTINCT e.term, a.date
+        FROM {source} a
+        INNER JOIN enrollment_data e ON e.id = a.enrollment_id
+        ORDER BY e.term, a.date
+        ''')
+
+    days = {}
+    rows = []
+    for term, date in cursor.fetchall():
+        day = days[term] = days.get(term, -1) + 1
+        rows.append((term, day, date, day // 63, 1 << (day % 63)))
+
+    cursor.executemany(f'{verb} INTO term_calendar (term, day, date, word, mask) VALUES (%s, %s, %s, %s, %s)',
+                       rows)
+
+def create_index(cursor, table, name, columns):
+    # MySQL has no CREATE INDEX IF NOT EXISTS, so check for it first
+    cursor.execute('''
+        SELECT COUNT(*) FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        ''', (table, name))
+
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f'CREATE INDEX {name} ON {table} ({columns})')
+
+def table_exists(cursor, table, kind='BASE TABLE'):
+    cursor.execute('''
+        SELECT COUNT(*) FROM information_schema.tables
+        WHERE table_schema = DATABASE() AND table_name = %s AND table_type = %s
+        ''', (table, kind))
+
+    return cursor.fetchone()[0] > 0
+
+def has_primary_key(cursor, table):
+    cursor.execute('''
+        SELECT COUNT(*) FROM information_schema.table_constraints
+        WHERE table_schema = DATABASE() AND table_name = %s AND constraint_type = 'PRIMARY KEY'
+        ''', (table,))
+
+    return cursor.fetchone()[0] > 0
+
+def add_foreign_key(cursor, table, name, definition):
+    cursor.execute('''
+        SELECT COUNT(*) FROM information_schema.table_constraints
+        WHERE table_schema = DATABASE() AND table_name = %s AND constraint_name = %s
+        ''', (table, name))
+
+    if cursor.fetchone()[0] == 0:
+        cursor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} {definition}')
+
+# Attendance used to be one row per student per day present. From version 4
+# each enrollment has a bitset over its term's class days instead: the
+# term_calendar numbers each term's days, and day n is bit n % 63 of word
+# n // 63 in attendance_bits (63 so the words fit a signed BIGINT). The
+# attendance view still reads as one row per day present; Database turns
+# writes to it into bit updates.
+convert_attendance = '''
+    {verb} INTO attendance_bits (enrollment_id, word, bits)
+    SELECT a.enrollment_id, c.word, SUM(c.mask)
+    FROM {source} a
+    INNER JOIN enrollment_data e ON e.id = a.enrollment_id
+    INNER JOIN term_calendar c ON c.term = e.term AND c.date = a.date
+    GROUP BY a.enrollment_id, c.word
+    '''
+
+# MySQL commits each statement on its own, so there the old table is moved
+# aside first and only dropped once the view has replaced it. Every statement
+# before that skips what is already done, so a step cut short can run again:
+# the conversion reads the old table for as long as it is there.
+def convert_old_attendance(cursor):
+    if table_exists(cursor, 'attendance'):
+        cursor.execute('RENAME TABLE attendance TO attendance_old')
+
+    if table_exists(cursor, 'attendance_old'):
+        fill_term_calendar(cursor, 'attendance_old', 'INSERT IGNORE')
+        cursor.execute(convert_attendance.format(verb='INSERT IGNORE', source='attendance_old'))
+
+attendance_view = '''
+    AS SELECT
+        b.enrollment_id,
+        c.date
+    FROM
+        attendance_bits b
+    INNER JOIN
+        enrollment_data e
+    ON
+        e.id = b.enrollment_id
+    INNER JOIN
+        term_calendar c
+    ON
+        c.term = e.term AND c.word = b.word
+    WHERE
+        b.bits & c.mask <> 0
+    '''
+
+# From version 5 the reports read from summaries kept up to date on every
+# write: attendance_summary has the days present for each enrollment, and
+# course_calendar the days roll was taken for each course, per term.
+fill_attendance_summary = '''
+    INSERT INTO attendance_summary (enrollment_id, days_present)
+    SELECT enrollment_id, SUM(BIT_COUNT(bits))
+    FROM attendance_bits
+    GROUP BY enrollment_id
+    '''
+
+fill_course_calendar = '''
+    INSERT INTO course_calendar (term, course_id, day)
+    SELECT DISTINCT e.term, e.course_id, c.day
+    FROM attendance_bits b
+    INNER JOIN enrollment_data e ON e.id = b.enrollment_id
+    INNER JOIN term_calendar c ON c.term = e.term AND c.word = b.word
+    WHERE b.bits & c.mask <> 0
+    '''
+
+# Grades had no key, so the same score could be entered twice. From version
+# 6 each score is keyed on its enrollment and assignment, so it can be
+# replaced in place. The highest of any duplicates is kept.
+#
+# MySQL commits each statement on its own here, so the live table is never
+# emptied: a keyed copy is filled and swapped in with one atomic RENAME. Once
+# grades has its key the swap is done, so a step cut short after it only
+# finishes the cleanup when it runs again. The copy has none of the old
+# foreign keys, which are added once the old table (and its constraint
+# names) are gone.
+def swap_keyed_grades(cursor):
+    if has_primary_key(cursor, 'grades'):
+        return
+
+    cursor.execute('DROP TABLE IF EXISTS grades_new')
+    cursor.execute('DROP TABLE IF EXISTS grades_old')
+    cursor.execute('''
+        CREATE TABLE grades_new (
+            assignment_id INT UNSIGNED NOT NULL,
+            enrollment_id INT UNSIGNED NOT NULL,
+            score INT,
+            PRIMARY KEY (enrollment_id, assignment_id)
+            )
+        ''')
+    cursor.execute('''
+        INSERT INTO grades_new (assignment_id, enrollment_id, score)
+        SELECT assignment_id, enrollment_id, MAX(score)
+        FROM grades
+        GROUP BY enrollment_id, assignment_id
+        ''')
+    cursor.execute('RENAME TABLE grades TO grades_old, grades_new TO grades')
+
+dedupe_grades_mysql = [
+    swap_keyed_grades,
+    'DROP TABLE IF EXISTS grades_old',
+    lambda cur: add_foreign_key(cur, 'grades', 'fk_grades_enrollment',
+                                'FOREIGN KEY (enrollment_id) REFERENCES enrollment_data(id) ON DELETE CASCADE'),
+    lambda cur: add_foreign_key(cur, 'grades', 'fk_grades_assignment',
+                                'FOREIGN KEY (assignment_id) REFERENCES assignments(id) ON DELETE CASCADE'),
+]
+
+# SQLite runs the whole upgrade in one transaction, and rows have a rowid to
+# tell identical duplicates apart, so only the extra rows are deleted
+dedupe_grades_sqlite = [
+    '''
+    DELETE FROM grades
+    WHERE EXISTS (
+        SELECT 1 FROM grades g
+        WHERE g.enrollment_id = grades.enrollment_id
+        AND g.assignment_id = grades.assignment_id
+        AND (g.score > grades.score
+             OR (grades.score IS NULL AND g.score IS NOT NULL)
+             OR (g.score IS grades.score AND g.rowid > grades.rowid))
+        )
+    ''',
+]
+
+# From version 9 every write to a table the app shows is logged in the
+# changelog by a trigger, so each client can poll it for what other clients
+# changed (see changefeed). Rows are logged by the id the app knows them by -
+# grades and attendance by their enrollment.
+changelog_tables = [
+    # (table, logged as, row id column)
+    ('students', 'students', 'id'),
+    ('courses', 'courses', 'id'),
+    ('assignments', 'assignments', 'id'),
+    ('enrollment_data', 'enrollment_data', 'id'),
+    ('grades', 'grades', 'enrollment_id'),
+    ('attendance_bits', 'attendance', 'enrollment_id'),
+]
+
+def changelog_triggers(backend_name):
+    statements = []
+
+    for table, logged, column in changelog_tables:
+        for event, op, row in (('INSERT', 'I', 'NEW'), ('UPDATE', 'U', 'NEW'), ('DELETE', 'D', 'OLD')):
+            name = f'{table}_log_{event.lower()}'
+            log = f"INSERT INTO changelog (table_name, row_id, op) VALUES ('{logged}', {row}.{column}, '{op}')"
+
+            if backend_name == 'sqlite':
+                statements.append(f'CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN {log}; END')
+            else:
+                statements.append(f'DROP TRIGGER IF EXISTS {name}')
+                statements.append(f'CREATE TRIGGER {name} AFTER {event} ON {table} FOR EACH ROW {log}')
+
+    return statements
+
+# From version 10 the terms and the courses offered each term are kept in
+# their own small tables, so the menus no longer scan every enrollment for
+# them. Triggers on enrollment_data add a term or offering with its first
+# enrollment and drop it with its last.
+#
+# The triggers go in before the catalog is filled, so enrollments made in
+# between are not missed; the fill then skips whatever they already added,
+# and can run again.
+def fill_catalog(insert_ignore):
+    return [f'{insert_ignore} INTO terms (name) SELECT DISTINCT term FROM enrollment_data',
+            f'''{insert_ignore} INTO term_courses (term, course_id)
+                SELECT DISTINCT term, course_id FROM enrollment_data''']
+
+def catalog_triggers(backend_name):
+    ignore = 'OR IGNORE' if backend_name == 'sqlite' else 'IGNORE'
+
+    def add(row):
+        return [f'INSERT {ignore} INTO terms (name) VALUES ({row}.term)',
+                f'INSERT {ignore} INTO term_courses (term, course_id) VALUES ({row}.term, {row}.course_id)']
+
+    def drop(row):
+        return [f'''DELETE FROM term_courses WHERE term = {row}.term AND course_id = {row}.course_id
+                    AND NOT EXISTS (SELECT 1 FROM enrollment_data e
+                                    WHERE e.term = {row}.term AND e.course_id = {row}.course_id)''',
+                f'''DELETE FROM terms WHERE name = {row}.term
+                    AND NOT EXISTS (SELECT 1 FROM term_courses t WHERE t.term = {row}.term)''']
+
+    # MySQL does not fire triggers for rows deleted by a foreign key cascade,
+    # so removing a student or course sweeps out whatever it left empty
+    prune = ['''DELETE FROM term_courses
+                WHERE NOT EXISTS (SELECT 1 FROM enrollment_data e
+                                  WHERE e.term = term_courses.term AND e.course_id = term_courses.course_id)''',
+             'DELETE FROM terms WHERE NOT EXISTS (SELECT 1 FROM term_courses t WHERE t.term = terms.name)']
+
+    triggers = [
+        ('enrollment_data_catalog_insert', 'INSERT', 'enrollment_data', add('NEW')),
+        ('enrollment_data_catalog_update', 'UPDATE', 'enrollment_data', add('NEW') + drop('OLD')),
+        ('enrollment_data_catalog_delete', 'DELETE', 'enrollment_data', drop('OLD')),
+    ]
+    if backend_name != 'sqlite':
+        triggers += [
+            ('students_catalog_delete', 'DELETE', 'students', prune),
+            ('courses_catalog_delete', 'DELETE', 'courses', prune),
+        ]
+
+    statements = []
+    for name, event, table, body in triggers:
+        body = ''.join(f'{statement}; ' for statement in body)
+
+        if backend_name == 'sqlite':
+            statements.append(f'CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table} BEGIN {body}END')
+        else:
+            statements.append(f'DROP TRIGGER IF EXISTS {name}')
+            statements.append(f'CREATE TRIGGER {name} AFTER {event} ON {table} FOR EACH ROW BEGIN {body}END')
+
+    return statements
+
+mysql_migrations = [
+    (1, 'Initial schema', [
+        '''
+        CREATE TABLE IF NOT EXISTS students (
+            id INT UNSIGNED AUTO_INCREMENT NOT NULL PRIMARY KEY,
+            name VARCHAR(30) NOT NULL,
+            CONSTRAINT UNIQUE (name)
+            )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS assignments (
+            id INT UNSIGNED AUTO_INCREMENT NOT NULL PRIMARY KEY,
+            name VARCHAR(30) NOT NULL,
+            CONSTRAINT UNIQUE (name)
+            )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS courses (
+            id INT UNSIGNED AUTO_INCREMENT NOT NULL PRIMARY KEY,
+            course_name VARCHAR(30) NOT NULL,
+            instructor_name VARCHAR(30) NOT NULL,
+            CONSTRAINT UNIQUE (course_name,instructor_name)
+            )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS enrollment_data (
+            id INT UNSIGNED AUTO_INCREMENT NOT NULL PRIMARY KEY,
+            student_id INT UNSIGNED NOT NULL REFERENCES student(id),
+            course_id INT UNSIGNED NOT NULL REFERENCES course(id),
+            term VARCHAR(30) NOT NULL,
+            CONSTRAINT UNIQUE (student_id, course_id, term)
+            )
+        ''',
+        '''
+        CREATE OR REPLACE VIEW
+            enrollment
+        AS SELECT
+            e.id,
+            e.term,
+            e.course_id c_id,
+            c.course_name c_name,
+            e.student_id s_id,
+            s.name s_name
+        FROM
+            enrollment_data e
+        INNER JOIN
+            courses c
+        ON
+            e.course_id = c.id
+        INNER JOIN
+            students s
+        ON
+            e.student_id = s.id
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS attendance (
+            enrollment_id INT UNSIGNED NOT NULL REFERENCES enrollment(id),
+            date DATE NOT NULL,
+            CONSTRAINT UNIQUE (enrollment_id, date)
+            )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS grades (
+            assignment_id INT UNSIGNED NOT NULL REFERENCES assignment(id),
+            enrollment_id INT UNSIGNED NOT NULL REFERENCES enrollment(id),
+            score INT
+        )
+        ''',
+    ]),
+    (2, 'Roster indexes', [
+        lambda cur: create_index(cur, 'attendance', 'attendance_date', 'date, enrollment_id'),
+        lambda cur: create_index(cur, 'enrollment_data', 'enrollment_term_course', 'term, course_id'),
+    ]),
+    # The REFERENCES clauses in the initial schema are parsed but ignored by
+    # MySQL, so nothing stopped orphaned rows. Clear those out and add real
+    # foreign keys - removing a student or course removes their enrollments,
+    # and removing an enrollment removes its attendance and grades.
+    (3, 'Foreign keys', [
+        'DELETE FROM enrollment_data WHERE student_id NOT IN (SELECT id FROM students)',
+        'DELETE FROM enrollment_data WHERE course_id NOT IN (SELECT id FROM courses)',
+        'DELETE FROM attendance WHERE enrollment_id NOT IN (SELECT id FROM enrollment_data)',
+        'DELETE FROM grades WHERE enrollment_id NOT IN (SELECT id FROM enrollment_data)',
+        'DELETE FROM grades WHERE assignment_id NOT IN (SELECT id FROM assignments)',
+        lambda cur: add_foreign_key(cur, 'enrollment_data', 'fk_enrollment_student',
+                                    'FOREIGN KEY (student_id) REFERENCES students(id) ON DELETE CASCADE'),
+        lambda cur: add_foreign_key(cur, 'enrollment_data', 'fk_enrollment_course',
+                                    'FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE'),
+        lambda cur: add_foreign_key(cur, 'attendance', 'fk_attendance_enrollment',
+                                    'FOREIGN KEY (enrollment_id) REFERENCES enrollment_data(id) ON DELETE CASCADE'),
+        lambda cur: add_foreign_key(cur, 'grades', 'fk_grades_enrollment',
+                                    'FOREIGN KEY (enrollment_id) REFERENCES enrollment_data(id) ON DELETE CASCADE'),
+        lambda cur: add_foreign_key(cur, 'grades', 'fk_grades_assignment',
+                                    'FOREIGN KEY (assignment_id) REFERENCES assignments(id) ON DELETE CASCADE'),
+    ]),
+    (4, 'Attendance bitmaps', [
+        '''
+        CREATE TABLE IF NOT EXISTS term_calendar (
+            term VARCHAR(30) NOT NULL,
+            day SMALLINT UNSIGNED NOT NULL,
+            date DATE NOT NULL,
+            word SMALLINT UNSIGNED NOT NULL,
+            mask BIGINT NOT NULL,
+            PRIMARY KEY (term, day),
+            CONSTRAINT UNIQUE (term, date)
+            )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS attendance_bits (
+            enrollment_id INT UNSIGNED NOT NULL,
+            word SMALLINT UNSIGNED NOT NULL,
+            bits BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (enrollment_id, word),
+            CONSTRAINT fk_attendance_bits_enrollment
+                FOREIGN KEY (enrollment_id) REFERENCES enrollment_data(id) ON DELETE CASCADE
+            )
+        ''',
+        convert_old_attendance,
+        'CREATE OR REPLACE VIEW attendance' + attendance_view,
+        'DROP TABLE IF EXISTS attendance_old',
+    ]),
+    (5, 'Attendance summary', [
+        '''
+        CREATE TABLE IF NOT EXISTS attendance_summary (
+            enrollment_id INT UNSIGNED NOT NULL PRIMARY KEY,
+            days_present INT UNSIGNED NOT NULL DEFAULT 0,
+            CONSTRAINT fk_attendance_summary_enrollment
+                FOREIGN KEY (enrollment_id) REFERENCES enrollment_data(id) ON DELETE CASCADE
+            )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS course_calendar (
+            term VARCHAR(30) NOT NULL,
+            course_id INT UNSIGNED NOT NULL,
+            day SMALLINT UNSIGNED NOT NULL,
+            PRIMARY KEY (term, course_id, day),
+            CONSTRAINT fk_course_calendar_course
+                FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE
+            )
+        ''',
+        fill_attendance_summary,
+        fill_course_calendar,
+    ]),
+    (6, 'Grades key', dedupe_grades_mysql),
+    # Type-ahead pickers search names by prefix. The unique keys on
+    # students.name and courses.course_name already cover that here.
+    (7, 'Name search indexes', []),
+    # Table views sort on any column, paging on (value, id). Secondary
+    # indexes carry the primary key, so one index per column serves both
+    # the order and the page seek.
+    (8, 'Sort indexes', [
+        lambda cur: create_index(cur, 'courses', 'courses_course_name', 'course_name'),
+        lambda cur: create_index(cur, 'courses', 'courses_instructor_name', 'instructor_name'),
+    ]),
+    # Rows deleted by a foreign key cascade do not fire triggers in MySQL,
+    # but clients treat a change to a parent as touching its children
+    (9, 'Change log', [
+        '''
+        CREATE TABLE IF NOT EXISTS changelog (
+            id BIGINT UNSIGNED AUTO_INCREMENT NOT NULL PRIMARY KEY,
+            table_name VARCHAR(30) NOT NULL,
+            row_id INT UNSIGNED NOT NULL,
+            op CHAR(1) NOT NULL
+            )
+        ''',
+    ] + changelog_triggers('mysql')),
+    (10, 'Term catalog', [
+        '''
+        CREATE TABLE IF NOT EXISTS terms (
+            name VARCHAR(30) NOT NULL PRIMARY KEY
+            )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS term_courses (
+            term VARCHAR(30) NOT NULL,
+            course_id INT UNSIGNED NOT NULL,
+            PRIMARY KEY (term, course_id),
+            CONSTRAINT fk_term_courses_term
+                FOREIGN KEY (term) REFERENCES terms(name) ON DELETE CASCADE,
+            CONSTRAINT fk_term_courses_course
+                FOREIGN KEY (course_id) REFERENCES courses(id) ON DELETE CASCADE
+            )
+        ''',
+    ] + catalog_triggers('mysql') + fill_catalog(backends.MySQLBackend.insert_ignore)),
+]
+
+# SQLite cannot add foreign keys to an existing table, so its initial schema
+# already has them and its step 3 has nothing left to do. The version numbers
+# still line up with MySQL's, so a version means the same schema on both.
+sqlite_migrations = [
+    (1, 'Initial schema', [
+        '''
+        CREATE TABLE IF NOT EXISTS students (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name VARCHAR(30) NOT NULL,
+            UNIQUE (name)
+            )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS assignments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name VARCHAR(30) NOT NULL,
+            UNIQUE (name)
+            )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS courses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            course_name VARCHAR(30) NOT NULL,
+            instructor_name VARCHAR(30) NOT NULL,
+            UNIQUE (course_name, instructor_name)
+            )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS enrollment_data (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            student_id INTEGER NOT NULL REFERENCES students(id) ON DELETE CASCADE,
+            course_id INTEGER NOT NULL REFERENCES courses(id) ON DELETE CASCADE,
+            term VARCHAR(30) NOT NULL,
+            UNIQUE (student_id, course_id, term)
+            )
+        ''',
+        '''
+        CREATE VIEW IF NOT EXISTS
+            enrollment
+        AS SELECT
+            e.id,
+            e.term,
+            e.course_id c_id,
+            c.course_name c_name,
+            e.student_id s_id,
+            s.name s_name
+        FROM
+            enrollment_data e
+        INNER JOIN
+            courses c
+        ON
+            e.course_id = c.id
+        INNER JOIN
+            students s
+        ON
+            e.student_id = s.id
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS attendance (
+            enrollment_id INTEGER NOT NULL REFERENCES enrollment_data(id) ON DELETE CASCADE,
+            date DATE NOT NULL,
+            UNIQUE (enrollment_id, date)
+            )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS grades (
+            assignment_id INTEGER NOT NULL REFERENCES assignments(id) ON DELETE CASCADE,
+            enrollment_id INTEGER NOT NULL REFERENCES enrollment_data(id) ON DELETE CASCADE,
+            score INT
+        )
+        ''',
+    ]),
+    (2, 'Roster indexes', [
+        'CREATE INDEX IF NOT EXISTS attendance_date ON attendance (date, enrollment_id)',
+        'CREATE INDEX IF NOT EXISTS enrollment_term_course ON enrollment_data (term, course_id)',
+    ]),
+    (3, 'Foreign keys', []),
+    (4, 'Attendance bitmaps', [
+        '''
+        CREATE TABLE IF NOT EXISTS term_calendar (
+            term VARCHAR(30) NOT NULL,
+            day INTEGER NOT NULL,
+            date DATE NOT NULL,
+            word INTEGER NOT NULL,
+            mask INTEGER NOT NULL,
+            PRIMARY KEY (term, day),
+            UNIQUE (term, date)
+            )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS attendance_bits (
+            enrollment_id INTEGER NOT NULL REFERENCES enrollment_data(id) ON DELETE CASCADE,
+            word INTEGER NOT NULL,
+            bits INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (enrollment_id, word)
+            )
+        ''',
+        fill_term_calendar,
+        convert_attendance.format(verb='INSERT', source='attendance'),
+        'DROP TABLE attendance',
+        'CREATE VIEW IF NOT EXISTS attendance' + attendance_view,
+    ]),
+    (5, 'Attendance summary', [
+        '''
+        CREATE TABLE IF NOT EXISTS attendance_summary (
+            enrollment_id INTEGER NOT NULL PRIMARY KEY REFERENCES enrollment_data(id) ON DELETE CASCADE,
+            days_present INTEGER NOT NULL DEFAULT 0
+            )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS course_calendar (
+            term VARCHAR(30) NOT NULL,
+            course_id INTEGER NOT NULL REFERENCES courses(id) ON DELETE CASCADE,
+            day INTEGER NOT NULL,
+            PRIMARY KEY (term, course_id, day)
+            )
+        ''',
+        fill_attendance_summary,
+        fill_course_calendar,
+    ]),
+    # SQLite cannot add a primary key to a table, but a unique index works
+    # just as well for upserts
+    (6, 'Grades key', dedupe_grades_sqlite + [
+        'CREATE UNIQUE INDEX IF NOT EXISTS grades_key ON grades (enrollment_id, assignment_id)',
+    ]),
+    # SQLite's LIKE ignores case, so it can only use an index that does too
+    (7, 'Name search indexes', [
+        'CREATE INDEX IF NOT EXISTS students_name_nocase ON students (name COLLATE NOCASE)',
+        'CREATE INDEX IF NOT EXISTS courses_name_nocase ON courses (course_name COLLATE NOCASE)',
+    ]),
+    # Sorting uses the plain indexes, filtering (LIKE) the NOCASE ones
+    (8, 'Sort indexes', [
+        'CREATE INDEX IF NOT EXISTS courses_course_name ON courses (course_name)',
+        'CREATE INDEX IF NOT EXISTS courses_instructor_name ON courses (instructor_name)',
+        'CREATE INDEX IF NOT EXISTS courses_instructor_nocase ON courses (instructor_name COLLATE NOCASE)',
+        'CREATE INDEX IF NOT EXISTS assignments_name_nocase ON assignments (name COLLATE NOCASE)',
+    ]),
+    (9, 'Change log', [
+        '''
+        CREATE TABLE IF NOT EXISTS changelog (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name VARCHAR(30) NOT NULL,
+            row_id INTEGER NOT NULL,
+            op CHAR(1) NOT NULL
+            )
+        ''',
+    ] + changelog_triggers('sqlite')),
+    (10, 'Term catalog', [
+        '''
+        CREATE TABLE IF NOT EXISTS terms (
+            name VARCHAR(30) NOT NULL PRIMARY KEY
+            )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS term_courses (
+            term VARCHAR(30) NOT NULL REFERENCES terms(name) ON DELETE CASCADE,
+            course_id INTEGER NOT NULL REFERENCES courses(id) ON DELETE CASCADE,
+            PRIMARY KEY (term, course_id)
+            )
+        ''',
+    ] + catalog_triggers('sqlite') + fill_catalog(backends.SQLiteBackend.insert_ignore)),
+]
+
+migrations = {
+    'mysql': mysql_migrations,
+    'sqlite': sqlite_migrations,
+}
+
+create_version_table = '''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INT UNSIGNED NOT NULL PRIMARY KEY,
+        description VARCHAR(100) NOT NULL,
+        applied TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    '''
+
+def latest(backend):
+    return migrations[backend.name][-1][0]
+
+def current_version(cursor, backend):
+    try:
+        cursor.execute('SELECT MAX(version) FROM schema_version')
+    except backend.Error:
+        # No version table yet
+        return 0
+
+    return cursor.fetchone()[0] or 0
+
+def run_steps(conn, cur, backend, *, commit_each=True):
+    cur.execute(create_version_table)
+    version = current_version(cur, backend)
+
+    for step, description, statements in migrations[backend.name]:
+        if step <= version:
+            continue
+
+        for statement in statements:
+            if callable(statement):
+                statement(cur)
+            else:
+                cur.execute(statement)
+
+        cur.execute('INSERT INTO schema_version (version, description) VALUES (%s, %s)',
+                    (step, description))
+        if commit_each:
+            conn.commit()
+
+def upgrade(conn, backend):
+    # The common case - the schema is already current, and this is the only
+    # query run at startup
+    with conn.cursor() as cur:
+        if current_version(cur, backend) >= latest(backend):
+            return
+
+    with conn.cursor() as cur:
+        if backend.name == 'sqlite':
+            # DDL is transactional in SQLite, and one immediate transaction
+            # for every step keeps other clients out until it is all done -
+            # they then find the schema current and have nothing to do
+            cur.execute('BEGIN IMMEDIATE')
+            try:
+                run_steps(conn, cur, backend, commit_each=False)
+            except backend.Error:
+                conn.rollback()
+                raise
+            conn.commit()
+            return
+
+        # Another client may be migrating at the same time
+        cur.execute('SELECT GET_LOCK(%s, 60)', ('sie5572020_migrate',))
+
+        try:
+            # Creating tables that already exist is expected on databases
+            # from before versioning, so only silence warnings in here
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', backend.Warning)
+                run_steps(conn, cur, backend)
+        finally:
+            cur.execute('SELECT RELEASE_LOCK(%s)', ('sie5572020_migrate',))
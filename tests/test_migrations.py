@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+
+import os
+import unittest
+
+import backends
+import migrations
+
+__author__ = 'Colin Leary'
+
+# Migration steps must be safe to run again after being cut short. The MySQL
+# tests need a scratch database they are free to empty, named by
+# SIE557_TEST_MYSQL_DATABASE (on localhost, as the python user).
+
+MYSQL_DATABASE = os.environ.get('SIE557_TEST_MYSQL_DATABASE')
+
+def run(cur, statements):
+    for statement in statements:
+        if callable(statement):
+            statement(cur)
+        else:
+            cur.execute(statement)
+
+def steps(backend_name, step):
+    for number, description, statements in migrations.migrations[backend_name]:
+        if number == step:
+            return statements
+
+    raise KeyError(step)
+
+def fill_duplicate_grades(cur):
+    cur.execute("INSERT INTO students (name) VALUES ('Ann')")
+    cur.execute("INSERT INTO courses (course_name, instructor_name) VALUES ('Biology', 'Bell')")
+    cur.execute("INSERT INTO assignments (name) VALUES ('Homework 1')")
+    cur.execute("INSERT INTO assignments (name) VALUES ('Homework 2')")
+    cur.execute("INSERT INTO enrollment_data (student_id, course_id, term) VALUES (1, 1, 'Fall 2019')")
+    cur.executemany('INSERT INTO grades (assignment_id, enrollment_id, score) VALUES (%s, %s, %s)',
+                    [(1, 1, 50), (1, 1, 70), (1, 1, 70), (2, 1, None), (2, 1, None)])
+
+class GradesKeyTest:
+    backend_name = None
+
+    def grades(self):
+        self.cur.execute('SELECT assignment_id, enrollment_id, score FROM grades ORDER BY assignment_id')
+        return [tuple(row) for row in self.cur.fetchall()]
+
+    def test_runs_twice(self):
+        run(self.cur, steps(self.backend_name, 6))
+        run(self.cur, steps(self.backend_name, 6))
+
+        self.assertEqual(self.grades(), [(1, 1, 70), (2, 1, None)])
+
+    def test_runs_again_after_swap(self):
+        # Cut short right after the first statement
+        run(self.cur, steps(self.backend_name, 6)[:1])
+        run(self.cur, steps(self.backend_name, 6))
+        run(self.cur, steps(self.backend_name, 6))
+
+        self.assertEqual(self.grades(), [(1, 1, 70), (2, 1, None)])
+
+class SQLiteGradesKeyTest(GradesKeyTest, unittest.TestCase):
+    backend_name = 'sqlite'
+
+    def setUp(self):
+        self.conn = backends.SQLiteBackend(path=':memory:').connect()
+        self.cur = self.conn.cursor()
+
+        for step in range(1, 6):
+            run(self.cur, steps('sqlite', step))
+        fill_duplicate_grades(self.cur)
+
+    def tearDown(self):
+        self.conn.close()
+
+@unittest.skipUnless(MYSQL_DATABASE, 'SIE557_TEST_MYSQL_DATABASE is not set')
+class MySQLGradesKeyTest(GradesKeyTest, unittest.TestCase):
+    backend_name = 'mysql'
+
+    def setUp(self):
+        self.conn = backends.MySQLBackend(database=MYSQL_DATABASE).connect()
+        self.cur = self.conn.cursor()
+
+        # Start from an empty database
+        self.cur.execute('SET FOREIGN_KEY_CHECKS = 0')
+        self.cur.execute('''
+            SELECT table_name, table_type FROM information_schema.tables
+            WHERE table_schema = DATABASE()
+            ''')
+        for table, kind in self.cur.fetchall():
+            self.cur.execute(f'DROP {"VIEW" if kind == "VIEW" else "TABLE"} {table}')
+        self.cur.execute('SET FOREIGN_KEY_CHECKS = 1')
+
+        for step in range(1, 6):
+            run(self.cur, steps('mysql', step))
+        fill_duplicate_grades(self.cur)
+
+    def tearDown(self):
+        self.conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
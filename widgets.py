@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+import tkinter as tk
+from tkinter import ttk
+
+__author__ = 'Colin Leary'
+
+# Keeps a Treeview in step with a result set keyed by row id.
+#
+# Rather than clearing the tree and inserting everything again, each update
+# works out which rows were added, removed, changed or moved and only touches
+# those items. Items that survive keep their selection, and the scroll
+# position is put back afterwards.
+class RowReconciler:
+    def __init__(self, tree_view):
+        self.tree_view = tree_view
+        self.values = {}
+        self.order = []
+
+    def update(self, rows):
+        new_order = [str(row[0]) for row in rows]
+        new_values = {str(row[0]): tuple(str(v) for v in row[1:]) for row in rows}
+
+        top = self.tree_view.yview()[0]
+
+        removed = [iid for iid in self.order if iid not in new_values]
+        if removed:
+            self.tree_view.delete(*removed)
+
+        # If the surviving rows are still in the same relative order, only new
+        # rows need placing - otherwise everything is moved into position
+        kept = [iid for iid in self.order if iid in new_values]
+        reordered = kept != [iid for iid in new_order if iid in self.values]
+
+        for index, iid in enumerate(new_order):
+            values = new_values[iid]
+
+            if iid not in self.values:
+                self.tree_view.insert('', index, iid, values=values)
+                continue
+
+            if self.values[iid] != values:
+                self.tree_view.item(iid, values=values)
+
+            if reordered:
+                self.tree_view.move(iid, '', index)
+
+        self.values = new_values
+        self.order = new_order
+
+        self.tree_view.yview_moveto(top)
+
+    def clear(self):
+        self.update([])
+
+def page_key(row, column):
+    # The key a row anchors the next page on - see VirtualTable.fetch_page
+    if column is None:
+        return row[0]
+
+    return row[column + 1], row[0]
+
+# A table view that only ever holds the rows currently on screen.
+#
+# Rows are fetched lazily a page at a time with keyset pagination - each page
+# is anchored on the key of the last row of the page before it. Pages are
+# kept in a small LRU cache so scrolling back and forth does not hit the
+# database. Pages load in the background, and the view fills in as they
+# arrive.
+#
+# Clicking a column heading sorts on that column (again for descending, a
+# third time to go back to id order), and the filter box keeps rows whose
+# sorted column - or first column, when unsorted - starts with its text.
+# Both are handed to the callbacks as (column, descending, prefix), with
+# column None for id order, to be done by the database.
+class VirtualTable(tk.Frame):
+    def __init__(self, master, titles, executor, fetch_page, count, *, seek=None, on_loaded=None,
+                 page_size=200, max_pages=8):
+        super().__init__(master)
+
+        # fetch_page(db, after, limit, *view) -> rows, each row starting with
+        #     its id. after is the key of the row before the page - its id,
+        #     or (value, id) when sorted.
+        # count(db, *view) -> total number of rows
+        # seek(db, offset, *view) -> key of the row before offset (optional)
+        # on_loaded() runs whenever a page arrives (optional)
+        self.titles = titles
+        self.executor = executor
+        self.fetch_page = fetch_page
+        self.count = count
+        self.seek = seek
+        self.on_loaded = on_loaded
+        self.page_size = page_size
+        self.max_pages = max_pages
+
+        self.total = 0
+        self.first = 0
+        self.visible = 1
+        self.generation = 0
+        self.pages = OrderedDict()
+        self.page_keys = {0: None}
+        self.loading = set()
+        self.selected = set()
+
+        self.sort_column = None
+        self.descending = False
+        self.prefix = ''
+        self.filter_timer = None
+
+        tk.Grid.rowconfigure(self, 1, weight=1)
+        tk.Grid.columnconfigure(self, 1, weight=1)
+
+        self.filter_label = tk.Label(self)
+        self.filter_label.grid(column=0, row=0, padx=5, sticky=tk.W)
+        self.filter_str = tk.StringVar()
+        self.filter_str.trace_add('write', self.on_filter)
+        entry = tk.Entry(self, textvariable=self.filter_str)
+        entry.grid(column=1, row=0, columnspan=2, padx=5, pady=2, sticky=tk.EW)
+
+        self.tree_view = ttk.Treeview(self, columns=titles, show='headings')
+        for i, col in enumerate(titles):
+            self.tree_view.heading(col, command=lambda i=i: self.sort_by(i))
+        self.tree_view.grid(column=0, row=1, columnspan=2, sticky=tk.NSEW)
+        self.reconciler = RowReconciler(self.tree_view)
+        self.show_headings()
+
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self.yview)
+        self.scrollbar.grid(column=2, row=1, sticky=tk.NS)
+
+        self.tree_view.bind('<Configure>', self.on_resize)
+        self.tree_view.bind('<<TreeviewSelect>>', self.on_select)
+        self.tree_view.bind('<MouseWheel>', self.on_wheel)
+        self.tree_view.bind('<Button-4>', lambda e: self.scroll_to(self.first - 3))
+        self.tree_view.bind('<Button-5>', lambda e: self.scroll_to(self.first + 3))
+
+    def refresh(self):
+        # Throw away everything cached, but stay at the same position. Pages
+        # still loading from before the refresh are ignored when they arrive.
+        self.generation += 1
+        self.pages.clear()
+        self.page_keys = {0: None}
+        self.loading.clear()
+
+        generation = self.generation
+        view = self.view()
+        self.executor.submit(lambda db: self.count(db, *view),
+                             lambda total: self.counted(generation, total),
+                             key=(self, 'count'))
+
+    def view(self):
+        return self.sort_column, self.descending, self.prefix
+
+    def reload(self, ids):
+        # Rows changed in place. In id order they stay where they are, so
+        # only the cached pages holding them are fetched again - sorted or
+        # filtered, they may have moved, so everything is.
+        if self.sort_column is not None or self.prefix:
+            self.refresh()
+            return
+
+        for page_no, rows in list(self.pages.items()):
+            if any(row[0] in ids for row in rows):
+                self.load(page_no)
+
+    def sort_by(self, column):
+        if self.sort_column != column:
+            self.sort_column, self.descending = column, False
+        elif not self.descending:
+            self.descending = True
+        else:
+            self.sort_column, self.descending = None, False
+
+        self.show_headings()
+        self.first = 0
+        self.refresh()
+
+    def show_headings(self):
+        for i, col in enumerate(self.titles):
+            arrow = ''
+            if i == self.sort_column:
+                arrow = ' \u25bc' if self.descending else ' \u25b2'
+            self.tree_view.heading(col, text=col + arrow)
+
+        filtered = self.titles[self.sort_column or 0]
+        self.filter_label.config(text=f'{filtered} starts with:')
+
+    def on_filter(self, *args):
+        # Wait for typing to pause before asking again
+        if self.filter_timer is not None:
+            self.after_cancel(self.filter_timer)
+        self.filter_timer = self.after(250, self.apply_filter)
+
+    def apply_filter(self):
+        self.filter_timer = None
+        if self.filter_str.get() == self.prefix:
+            return
+
+        self.prefix = self.filter_str.get()
+        self.first = 0
+        self.refresh()
+
+    def counted(self, generation, total):
+        if generation != self.generation:
+            return
+
+        self.total = total
+        self.scroll_to(self.first)
+
+    def selection(self):
+        return tuple(str(i) for i in sorted(self.selected, key=int))
+
+    def yview(self, *args):
+        if args[0] == 'moveto':
+            self.scroll_to(int(float(args[1]) * self.total))
+        elif args[0] == 'scroll':
+            step = self.visible if args[2] == 'pages' else 1
+            self.scroll_to(self.first + int(args[1]) * step)
+
+    def on_wheel(self, event):
+        self.scroll_to(self.first + (-3 if event.delta > 0 else 3))
+
+    def on_resize(self, event):
+        style = ttk.Style()
+        rowheight = int(style.lookup('Treeview', 'rowheight') or 20)
+
+        # Leave room for the heading row
+        self.visible = max(1, event.height // rowheight - 1)
+        self.scroll_to(self.first)
+
+    def on_select(self, event):
+        shown = set(self.tree_view.get_children())
+        self.selected -= shown
+        self.selected |= set(self.tree_view.selection())
+
+    def scroll_to(self, first):
+        self.first = max(0, min(first, self.total - self.visible))
+        self.render(self.rows(self.first, self.visible))
+
+        if self.total > 0:
+            self.scrollbar.set(self.first / self.total,
+                               (self.first + self.visible) / self.total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def render(self, rows):
+        self.reconciler.update(rows)
+
+        shown = [str(row[0]) for row in rows if str(row[0]) in self.selected]
+        self.tree_view.selection_set(shown)
+
+    def rows(self, start, n):
+        rows = []
+        page_no = start // self.page_size
+
+        while len(rows) < n and page_no * self.page_size < self.total:
+            page = self.page(page_no)
+            if not page:
+                break
+
+            lo = max(0, start - page_no * self.page_size)
+            rows.extend(page[lo:lo + n - len(rows)])
+            page_no += 1
+
+        # Start on the next page before it is needed
+        if page_no * self.page_size < self.total:
+            self.page(page_no)
+
+        return rows
+
+    def page(self, page_no):
+        if page_no in self.pages:
+            self.pages.move_to_end(page_no)
+            return self.pages[page_no]
+
+        self.load(page_no)
+
+        # Only there already if the executor ran the load synchronously
+        return self.pages.get(page_no)
+
+    def load(self, page_no):
+        if page_no in self.loading:
+            return
+
+        self.loading.add(page_no)
+
+        known = max(k for k in self.page_keys if k <= page_no)
+        after = self.page_keys[known]
+        generation = self.generation
+        view = self.view()
+
+        def work(db):
+            keys = {}
+            start = after
+
+            # Jumping far ahead - ask the database where the page starts
+            # rather than pulling every page in between
+            if known != page_no and self.seek is not None and page_no - known > 2:
+                start = self.seek(db, page_no * self.page_size, *view)
+            else:
+                for k in range(known, page_no):
+                    skipped = self.fetch_page(db, start, self.page_size, *view)
+                    start = page_key(skipped[-1], view[0]) if skipped else start
+                    keys[k + 1] = start
+
+            keys[page_no] = start
+
+            return keys, self.fetch_page(db, start, self.page_size, *view)
+
+        self.executor.submit(work,
+                             lambda result: self.loaded(generation, page_no, *result),
+                             key=(self, page_no))
+
+    def loaded(self, generation, page_no, keys, rows):
+        if generation != self.generation:
+            return
+
+        self.loading.discard(page_no)
+        self.page_keys.update(keys)
+
+        self.pages[page_no] = rows
+        if rows:
+            self.page_keys[page_no + 1] = page_key(rows[-1], self.sort_column)
+
+        # Bound the cache, dropping the least recently used page
+        while len(self.pages) > self.max_pages:
+            self.pages.popitem(last=False)
+
+        self.scroll_to(self.first)
+
+        if self.on_loaded is not None:
+            self.on_loaded()
+
+# A combobox that looks up matching rows as you type.
+#
+# Each keystroke restarts a short timer, and the text is only looked up once
+# typing pauses. search(db, prefix) runs on the executor and returns rows of
+# (id, label, *details); a lookup still running for older text is thrown
+# away. Press Down to pick from the matches - picking one (or typing one out
+# in full) sets id_var to its id, anything else sets it to invalid_id.
+class TypeAhead(ttk.Combobox):
+    def __init__(self, master, executor, search, id_var, *, invalid_id=-1, delay_ms=150, **kwargs):
+        super().__init__(master, **kwargs)
+
+        self.executor = executor
+        self.search = search
+        self.id_var = id_var
+        self.invalid_id = invalid_id
+        self.delay_ms = delay_ms
+        self.timer = None
+
+        # label -> id, starting with whatever was already picked
+        self.matches = {}
+        if id_var.get() != invalid_id:
+            self.matches[self.get()] = id_var.get()
+
+        self.bind('<KeyRelease>', self.typed)
+        self.bind('<<ComboboxSelected>>', self.picked)
+
+    def typed(self, event):
+        if event.keysym in ('Up', 'Down', 'Return', 'Tab', 'Escape'):
+            return
+
+        self.picked()
+
+        if self.timer is not None:
+            self.after_cancel(self.timer)
+        self.timer = self.after(self.delay_ms, self.lookup)
+
+    def lookup(self):
+        self.timer = None
+        prefix = self.get()
+
+        self.executor.submit(lambda db: self.search(db, prefix),
+                             self.fill,
+                             key=(self, 'search'))
+
+    def fill(self, rows):
+        # The window may have been closed while the lookup ran
+        if not self.winfo_exists():
+            return
+
+        self.matches = {label(row): row[0] for row in rows}
+        self['values'] = list(self.matches)
+        self.picked()
+
+    def picked(self, *args):
+        self.id_var.set(self.matches.get(self.get(), self.invalid_id))
+
+def label(row):
+    # 'Alien Ethics (Susie Adams)' for (id, 'Alien Ethics', 'Susie Adams')
+    if len(row) > 2:
+        return f'{row[1]} ({", ".join(str(v) for v in row[2:])})'
+
+    return str(row[1])
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+from collections import OrderedDict
+
+__author__ = 'Colin Leary'
+
+# Batches small edits into one transaction.
+#
+# Each edit is queued under a key naming the row it touches, so marking a
+# student present and then not present again leaves only the last change.
+# The frame shows queued edits straight away (see state()), and the batch is
+# handed to save() a short while after the last edit, or as soon as flush()
+# is called. save() writes it to the local journal, which replays it into
+# the database in order (see journal), and the frame keeps showing the
+# edits until replayed() says they are in.
+#
+# If a batch can never be applied nothing in it is saved - the frame is
+# told, and goes back to showing what is really in the database.
+class WriteBatch:
+    def __init__(self, master, save, *, delay_ms=1000, on_failed=None, on_change=None):
+        # save(changes) -> journal id. on_failed() runs after a batch fails
+        # to save, on_change() whenever the number of unsaved edits changes.
+        self.master = master
+        self.save = save
+        self.delay_ms = delay_ms
+        self.on_failed = on_failed
+        self.on_change = on_change
+
+        self.pending = OrderedDict()
+        # Journal id -> the edits in that batch, oldest first
+        self.saving = OrderedDict()
+        self.timer = None
+
+    def __len__(self):
+        return len(self.pending) + sum(len(edits) for edits in self.saving.values())
+
+    def insert(self, key, table, columns, row):
+        self.queue(key, ('insert', table, tuple(columns), tuple(row)))
+
+    def upsert(self, key, table, columns, row):
+        self.queue(key, ('upsert', table, tuple(columns), tuple(row)))
+
+    def remove(self, key, table, where):
+        self.queue(key, ('remove', table, tuple(where), tuple(where.values())))
+
+    def queue(self, key, edit):
+        self.pending.pop(key, None)
+        self.pending[key] = edit
+
+        if self.timer is None:
+            self.timer = self.master.after(self.delay_ms, self.flush)
+
+        self.changed()
+
+    def state(self, key):
+        # 'insert', 'upsert' or 'remove' if there is an unsaved edit to the
+        # row, or None if the database is up to date
+        edit = self.edit(key)
+
+        return edit[0] if edit is not None else None
+
+    def edit(self, key):
+        # The newest unsaved edit to the row
+        edit = self.pending.get(key)
+        if edit is not None:
+            return edit
+
+        for edits in reversed(self.saving.values()):
+            if key in edits:
+                return edits[key]
+
+        return None
+
+    def edits(self):
+        # Every unsaved edit, oldest first
+        edits = OrderedDict()
+        for batch in list(self.saving.values()) + [self.pending]:
+            for key, edit in batch.items():
+                edits.pop(key, None)
+                edits[key] = edit
+
+        return list(edits.items())
+
+    def flush(self):
+        if self.timer is not None:
+            self.master.after_cancel(self.timer)
+            self.timer = None
+
+        if not self.pending:
+            return
+
+        id = self.save(changes_for(self.pending.values()))
+        self.saving[id] = self.pending
+        self.pending = OrderedDict()
+
+        self.changed()
+
+    def replayed(self, ids, success):
+        # Told about every batch the journal replays - only ours matter
+        mine = [id for id in ids if id in self.saving]
+        if not mine:
+            return
+
+        for id in mine:
+            del self.saving[id]
+
+        if not success and self.on_failed is not None:
+            self.on_failed()
+
+        self.changed()
+
+    def changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+def changes_for(edits):
+    # Inserts (or upserts) into the same columns become one multi-row
+    # statement, and removes that only differ in their last column become
+    # one DELETE ... IN
+    inserts = OrderedDict()
+    removes = OrderedDict()
+
+    for kind, table, columns, values in edits:
+        if kind == 'remove':
+            removes.setdefault((table, columns, values[:-1]), []).append(values[-1])
+        else:
+            inserts.setdefault((kind, table, columns), []).append(values)
+
+    changes = []
+    for (table, columns, values), last in removes.items():
+        where = dict(zip(columns, values))
+        where[columns[-1]] = last
+        changes.append(('remove', table, where))
+
+    for (kind, table, columns), rows in inserts.items():
+        changes.append((kind, table, columns, rows))
+
+    return changes